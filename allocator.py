@@ -0,0 +1,200 @@
+import asyncio
+import bisect
+import logging
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, update
+
+import cache
+import payments
+from config import ALLOC_POLICY, ALLOC_MIN_DAYS
+from db import async_session, adjust_members_count, Account, Member, Payment
+
+logger = logging.getLogger(__name__)
+
+BEST_FIT, FIRST_EXPIRING = "best_fit", "first_expiring"
+
+Allocation = namedtuple("Allocation", "payment_id user_id account_id account_label renewed")
+
+_accounts = Account.__table__
+
+
+class AllocationError(ValueError):
+    pass
+
+
+def _end_key(cycle_end):
+    # Workspaces without a cycle_end never expire
+    return cycle_end.timestamp() if cycle_end else math.inf
+
+
+class SeatIndex:
+    """
+    Active workspaces that still have free seats, kept sorted two ways: by
+    (free seats, -cycle end) for best fit and by cycle end for first expiring.
+    Picking is a bisect or a short scan; a seat change moves one entry.
+    """
+
+    def __init__(self):
+        self.free = {}  # account_id -> free seats
+        self.ends = {}  # account_id -> cycle_end key (every active workspace, full ones too)
+        self._by_fit = []  # (free, -end, account_id), free > 0 only
+        self._by_expiry = []  # (end, account_id), free > 0 only
+
+    def build(self, rows):
+        """rows: (account_id, free seats, cycle_end)."""
+        self.free = {acc_id: max(free, 0) for acc_id, free, _ in rows}
+        self.ends = {acc_id: _end_key(cycle_end) for acc_id, _, cycle_end in rows}
+        open_ = [acc_id for acc_id, free in self.free.items() if free > 0]
+        self._by_fit = sorted((self.free[a], -self.ends[a], a) for a in open_)
+        self._by_expiry = sorted((self.ends[a], a) for a in open_)
+
+    def _unlink(self, acc_id):
+        free = self.free.get(acc_id, 0)
+        if free > 0:
+            end = self.ends[acc_id]
+            del self._by_fit[bisect.bisect_left(self._by_fit, (free, -end, acc_id))]
+            del self._by_expiry[bisect.bisect_left(self._by_expiry, (end, acc_id))]
+
+    def set_free(self, acc_id, free):
+        if acc_id not in self.ends:
+            return  # not an active workspace
+        self._unlink(acc_id)
+        self.free[acc_id] = free = max(free, 0)
+        if free > 0:
+            end = self.ends[acc_id]
+            bisect.insort(self._by_fit, (free, -end, acc_id))
+            bisect.insort(self._by_expiry, (end, acc_id))
+
+    def pick(self, policy, not_before):
+        """A workspace with a free seat whose cycle ends at/after `not_before`, or None."""
+        if policy == FIRST_EXPIRING:
+            i = bisect.bisect_left(self._by_expiry, (not_before,))
+            return self._by_expiry[i][1] if i < len(self._by_expiry) else None
+        for _, neg_end, acc_id in self._by_fit:
+            if -neg_end >= not_before:
+                return acc_id
+        return None
+
+
+class SeatAllocator:
+    """
+    Places paying users into workspaces when their payment is approved.
+
+    The SeatIndex is loaded once and then maintained from the allocator's own
+    commits; it is reloaded only when some other write moved the "accounts" cache
+    version (new accounts, imports, another cluster worker). The index only
+    proposes a workspace: the seat is taken by a conditional UPDATE of
+    members_count in the same transaction that writes the Member and settles the
+    Payment, so a stale index can never oversell. Approvals are serialized per
+    process, so a burst of them costs one small transaction each.
+
+    Members are identified by telegram_id. A payer who was never imported gets a
+    row without an email; importer.sync_members (keyed by email) leaves such rows
+    and their seats alone.
+    """
+
+    def __init__(self, policy=ALLOC_POLICY, min_days=ALLOC_MIN_DAYS):
+        if policy not in (BEST_FIT, FIRST_EXPIRING):
+            raise ValueError(f"Unknown allocation policy: {policy}")
+        self.policy = policy
+        self.min_days = min_days
+        self.index = SeatIndex()
+        self._cycle_end = {}
+        self._labels = {}
+        self._stamp = None
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        stamp = cache.version("accounts")
+        async with async_session() as session:
+            rows = (await session.execute(
+                select(Account.id, Account.seats_total, Account.members_count, Account.cycle_end, Account.account_label)
+                .where(Account.status == "active")
+            )).all()
+        self.index.build([(r.id, (r.seats_total or 0) - (r.members_count or 0), r.cycle_end) for r in rows])
+        self._cycle_end = {r.id: r.cycle_end for r in rows}
+        self._labels = {r.id: r.account_label for r in rows}
+        self._stamp = stamp
+        logger.debug(f"Seat index loaded: {len(rows)} workspaces, {sum(self.index.free.values())} free seats")
+
+    async def _reserve(self, session, preferred, not_before):
+        """Takes one seat in the transaction; returns the account id or None when the fleet is full."""
+        tried = set()
+        acc_id = preferred if self.index.free.get(preferred, 0) > 0 and self.index.ends[preferred] >= not_before else None
+        while True:
+            if acc_id is None:
+                acc_id = self.index.pick(self.policy, not_before)
+            if acc_id is None or acc_id in tried:
+                return None
+            result = await session.execute(
+                update(_accounts)
+                .where(_accounts.c.id == acc_id, _accounts.c.status == "active",
+                       _accounts.c.members_count < _accounts.c.seats_total)
+                .values(members_count=_accounts.c.members_count + 1)
+            )
+            if result.rowcount == 1:
+                return acc_id
+            # The index was behind the database: drop the workspace and try the next one
+            tried.add(acc_id)
+            self.index.set_free(acc_id, 0)
+            self._stamp = None
+            acc_id = None
+
+    async def approve(self, pay_id, admin_id):
+        """
+        Approves a pending payment: keeps a renewing member in their live workspace,
+        otherwise reserves a seat (the payment's account first, if it has room) and
+        assigns the member to it. Raises AllocationError when nothing was changed.
+        """
+        async with self._lock:
+            if self._stamp is None or self._stamp != cache.version("accounts"):
+                await self.load()
+            stamp = self._stamp
+            now = datetime.utcnow()
+            not_before = (now + timedelta(days=self.min_days)).timestamp()
+
+            async with async_session() as session:
+                async with session.begin():
+                    pay = (await session.execute(
+                        select(Payment.user_id, Payment.account_id, Payment.status).where(Payment.id == pay_id)
+                    )).first()
+                    if pay is None or pay.status != "Pending":
+                        raise AllocationError("این فیش قبلا بررسی شده است.")
+                    member = (await session.execute(
+                        select(Member.id, Member.account_id).where(Member.telegram_id == pay.user_id)
+                    )).first()
+                    old_acc = member.account_id if member else None
+
+                    renewed = old_acc is not None and self.index.ends.get(old_acc, -math.inf) > now.timestamp()
+                    if renewed:
+                        acc_id = old_acc
+                    else:
+                        acc_id = await self._reserve(session, pay.account_id, not_before)
+                        if acc_id is None:
+                            raise AllocationError("هیچ اکانتی صندلی خالی ندارد.")
+
+                    values = {"account_id": acc_id, "status": "Active", "active": True, "auto_expired_at": None,
+                              "expiry_date": self._cycle_end.get(acc_id)}
+                    if member:
+                        await session.execute(update(Member).where(Member.id == member.id).values(**values))
+                        if not renewed:
+                            await adjust_members_count(session, {old_acc: -1})
+                    else:
+                        await session.execute(insert(Member).values(
+                            telegram_id=pay.user_id, role="Member", date_added=now, **values))
+                    if not await payments.settle(session, pay_id, admin_id, "Approved", acc_id):
+                        raise AllocationError("این فیش توسط ادمین دیگری در حال بررسی است.")
+
+            if not renewed:
+                self.index.set_free(acc_id, self.index.free[acc_id] - 1)
+                if old_acc is not None:
+                    self.index.set_free(old_acc, self.index.free.get(old_acc, 0) + 1)
+                # Our own commit moved the accounts version by one; anything beyond that is someone else's write
+                self._stamp = stamp + 1 if self._stamp == stamp and cache.version("accounts") == stamp + 1 else None
+
+        logger.info(f"Admin {admin_id} approved payment {pay_id}: user {pay.user_id} -> account {acc_id}"
+                    f"{' (renewal)' if renewed else ''}")
+        return Allocation(pay_id, pay.user_id, acc_id, self._labels.get(acc_id), renewed)
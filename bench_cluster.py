@@ -0,0 +1,104 @@
+"""
+Cluster load test: throughput of `cluster.py` with 1, 2, 4... workers.
+
+Runs the fake Telegram API in this process and the cluster as a subprocess polling
+it. Every chat sends a "search" button press followed by a search text, so the
+second update is only answered if the first one (which sets the FSM state) ran
+before it; the run fails if any chat's replies arrive out of order.
+
+    python bench_cluster.py                       # 500 chats, 1/2/4 workers
+    python bench_cluster.py --chats 2000 --workers 1 8
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from fake_telegram import FakeTelegram
+
+FAKE_API_PORT = 18082
+EXPECTED_REPLIES = ["editMessageText", "sendMessage"]
+
+
+def make_chat_updates(chats, first_id):
+    """A button press from every chat, then a text from every chat (update ids ascending)."""
+    now = int(time.time())
+    presses, texts = [], []
+    for n in range(chats):
+        chat_id = 20_000_000 + n
+        user = {"id": chat_id, "is_bot": False, "first_name": "Admin"}
+        chat = {"id": chat_id, "type": "private"}
+        presses.append({"callback_query": {
+            "id": str(chat_id), "from": user, "chat_instance": str(chat_id), "data": "search_member",
+            "message": {"message_id": 1, "date": now, "chat": chat, "text": "menu"},
+        }})
+        texts.append({"message": {"message_id": 2, "date": now, "chat": chat, "from": user, "text": f"zz{n}"}})
+    updates = presses + texts
+    for update_id, update in enumerate(updates, first_id):
+        update["update_id"] = update_id
+    return updates
+
+
+async def run(fake, workers, chats, first_id, workdir):
+    env = dict(os.environ)
+    env.update({
+        "BOT_TOKEN": "123456:bench",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{FAKE_API_PORT}",
+        "DB_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, f'bench{workers}.db')}",
+        "ADMIN_IDS": ",".join(str(20_000_000 + n) for n in range(chats)),
+        "CLUSTER_SOCKET_DIR": os.path.join(workdir, f"sock{workers}"),
+        "LOG_FILE": os.path.join(workdir, f"cluster{workers}.log"),
+        "LOG_LEVEL": "WARNING",
+        "POLLING_TIMEOUT": "1",
+        "METRICS_PORT": "0",
+        "BOT_MODE": "polling",
+    })
+    fake.reset(chats, per_chat=len(EXPECTED_REPLIES))
+    fake.polled.clear()
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cluster.py"),
+        "--workers", str(workers), env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        await asyncio.wait_for(fake.polled.wait(), 120)
+        fake.push(make_chat_updates(chats, first_id))
+        await asyncio.wait_for(fake.all_done.wait(), 300)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        await proc.wait()
+
+    elapsed = max(fake.done_at.values()) - min(fake.sent_at.values())
+    out_of_order = sum(1 for replies in fake.replies.values() if replies != EXPECTED_REPLIES)
+    return 2 * chats / elapsed, out_of_order
+
+
+async def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--chats", type=int, default=500)
+    ap.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = ap.parse_args(argv)
+
+    fake = FakeTelegram()
+    runner = await fake.serve("127.0.0.1", FAKE_API_PORT)
+    failures = 0
+    print(f"{'workers':>8}{'updates':>9}{'upd/s':>10}{'speedup':>9}{'out of order':>14}")
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_cluster_") as workdir:
+            base = None
+            first_id = 1
+            for workers in args.workers:
+                rate, out_of_order = await run(fake, workers, args.chats, first_id, workdir)
+                first_id += 2 * args.chats
+                base = base or rate
+                failures += out_of_order
+                print(f"{workers:>8}{2 * args.chats:>9}{rate:>10,.0f}{rate / base:>8.2f}x{out_of_order:>14}")
+    finally:
+        await runner.cleanup()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
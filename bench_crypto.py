@@ -0,0 +1,105 @@
+"""
+Credential encryption benchmark: list and export latency with encrypted credential
+columns (lazy decryption) versus reading the same columns as plain text, plus the
+cost of eagerly decrypting every row.
+
+    python bench_crypto.py --accounts 5000 --members 50000
+
+Runs against a throw-away SQLite file, never the bot's database.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+_workdir = tempfile.mkdtemp(prefix="bench_crypto_")
+os.environ["DB_URL"] = f"sqlite+aiosqlite:///{os.path.join(_workdir, 'bench.db')}"
+if not os.getenv("SECRET_KEY"):
+    from cryptography.fernet import Fernet
+    os.environ["SECRET_KEY"] = Fernet.generate_key().decode()
+
+from sqlalchemy import String, insert, select, type_coerce
+
+import db
+import export
+from db import async_session, Account, Member
+
+
+async def populate(accounts, members):
+    await db.init_db()
+    async with async_session() as session:
+        await session.execute(insert(Account), [
+            {"owner_email": f"owner{i}@example.com", "account_label": f"GPT-{i:04d}",
+             "login_email": f"login{i}@example.com", "login_password": f"pass-{i}-secret"}
+            for i in range(accounts)
+        ])
+        await session.execute(insert(Member), [
+            {"account_id": i % accounts + 1, "name": f"User {i}", "email": f"user{i}@example.com"}
+            for i in range(members)
+        ])
+        await session.commit()
+
+
+async def list_encrypted():
+    async with async_session() as session:
+        return (await session.execute(select(*Account.__table__.columns))).all()
+
+
+async def list_decrypted():
+    rows = await list_encrypted()
+    for row in rows:
+        str(row.login_email), str(row.login_password)
+    return rows
+
+
+async def list_plain():
+    # Same columns read as plain text, i.e. what the list costs with encryption off
+    table = Account.__table__
+    cols = [type_coerce(c, String) if isinstance(c.type, db.EncryptedString) else c for c in table.columns]
+    async with async_session() as session:
+        return (await session.execute(select(*cols))).all()
+
+
+async def run_export():
+    path, _ = await export.write_export("csv")
+    os.remove(path)
+
+
+async def timed(func, repeat, before=None):
+    best = float("inf")
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        await func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--accounts", type=int, default=2000)
+    ap.add_argument("--members", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args(argv)
+
+    await populate(args.accounts, args.members)
+    cases = [
+        ("list, encryption off", list_plain, None),
+        ("list, encrypted (lazy)", list_encrypted, None),
+        ("list, decrypt all (cold LRU)", list_decrypted, db._decrypt.cache_clear),
+        ("list, decrypt all (warm LRU)", list_decrypted, None),
+        ("export CSV", run_export, None),
+    ]
+    print(f"{args.accounts} accounts, {args.members} members, best of {args.repeat}")
+    for name, func, before in cases:
+        elapsed = await timed(func, args.repeat, before)
+        print(f"{name:<32}{elapsed * 1000:>10.1f} ms")
+    await db.engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
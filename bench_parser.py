@@ -0,0 +1,173 @@
+"""
+Parser benchmark: generates synthetic OpenAI members-page pastes, runs every parser
+implementation over them, checks the output against the generator's ground truth
+and reports lines/sec, members/sec and peak memory.
+
+    python bench_parser.py                       # default sizes, compare to baseline
+    python bench_parser.py --sizes 100 100000    # custom sizes
+    python bench_parser.py --save-baseline       # store current throughput as baseline
+
+Exits non-zero when the output is wrong or throughput falls below the stored baseline
+or below --min-members-per-sec. The baseline is machine specific and not committed;
+the absolute floor is deliberately low so it holds on slow CI machines too.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import importer
+from parser import parse_members_text, iter_members
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+MIN_MEMBERS_PER_SEC = 20_000
+
+FIRST_NAMES = ["Sara", "Ali", "John", "Maryam", "Reza", "Emily", "Omid", "Nina", "David", "Leila"]
+LAST_NAMES = ["Ahmadi", "Smith", "Karimi", "Brown", "Rahimi", "Garcia", "Moradi", "Lee", "Hosseini"]
+PAGE_HEADER = ["Invite member", "Filter", "Name", "Account type", "Date added"]
+
+
+def generate_members_page(count, seed=42):
+    """
+    Builds a paste that looks like a copied members page, plus its ground truth.
+    Mixes in repeated page headers, blank lines, missing dates, missing names and
+    Owner/Admin roles. Ground-truth dates are None where the paste has no date.
+    """
+    rnd = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    lines = list(PAGE_HEADER)
+    truth = []
+    for i in range(count):
+        if i and i % 50 == 0:
+            lines += [""] + PAGE_HEADER + [""]
+        has_name = rnd.random() > 0.02
+        name = f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)} {i}" if has_name else "Unknown"
+        email = f"user{i}.{rnd.randrange(10**6)}@example{rnd.randrange(20)}.com"
+        role = rnd.choices(["Member", "Owner", "Admin"], weights=[90, 2, 8])[0]
+        date_added = start + timedelta(days=rnd.randrange(700)) if rnd.random() > 0.1 else None
+
+        if has_name:
+            lines.append(name)
+        lines.append(email)
+        lines.extend([""] * rnd.randrange(3))
+        lines.append(role)
+        if date_added:
+            lines.append(date_added.strftime("%b %d, %Y").replace(" 0", " "))
+        if rnd.random() < 0.3:
+            lines.append("")
+        truth.append({"name": name, "email": email, "role": role, "date_added": date_added})
+    return "\n".join(lines), truth
+
+
+def _parse_text(text):
+    return parse_members_text(text)
+
+
+def _iter_stream(text):
+    return list(iter_members(io.StringIO(text)))
+
+
+def _chunked(text):
+    return [m for chunk in importer.split_input(text) for m in importer.parse_chunk(importer.TEXT, chunk)]
+
+
+IMPLEMENTATIONS = {
+    "parse_members_text": _parse_text,
+    "iter_members(stream)": _iter_stream,
+    "importer(chunked)": _chunked,
+}
+
+
+def check_output(parsed, truth):
+    """Returns a list of human readable mismatches (empty when the output is correct)."""
+    errors = []
+    if len(parsed) != len(truth):
+        errors.append(f"expected {len(truth)} members, got {len(parsed)}")
+    for idx, (got, want) in enumerate(zip(parsed, truth)):
+        for key in ("name", "email", "role"):
+            if got[key] != want[key]:
+                errors.append(f"#{idx} {key}: {got[key]!r} != {want[key]!r}")
+        if want["date_added"] and got["date_added"] != want["date_added"]:
+            errors.append(f"#{idx} date_added: {got['date_added']} != {want['date_added']}")
+        if len(errors) >= 10:
+            break
+    return errors
+
+
+def run_case(func, text, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parsed = func(text)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    func(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return parsed, best, peak
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    ap.add_argument("--min-members-per-sec", type=float, default=MIN_MEMBERS_PER_SEC,
+                    help="absolute throughput floor, checked with or without a baseline (0 disables)")
+    ap.add_argument("--save-baseline", action="store_true")
+    args = ap.parse_args(argv)
+
+    baseline = load_baseline()
+    results = {}
+    failures = []
+
+    print(f"{'impl':<22}{'members':>9}{'lines/s':>14}{'members/s':>13}{'peak MiB':>10}")
+    for size in args.sizes:
+        text, truth = generate_members_page(size)
+        line_count = text.count("\n") + 1
+        for name, func in IMPLEMENTATIONS.items():
+            parsed, elapsed, peak = run_case(func, text, args.repeat)
+            key = f"{name}@{size}"
+            members_per_sec = size / elapsed
+            results[key] = members_per_sec
+            print(f"{name:<22}{size:>9}{line_count / elapsed:>14,.0f}{members_per_sec:>13,.0f}{peak / 2**20:>10.1f}")
+
+            errors = check_output(parsed, truth)
+            if errors:
+                failures.append(f"{key}: wrong output: " + "; ".join(errors))
+            floor = baseline.get(key, 0) * (1 - args.tolerance)
+            if members_per_sec < floor:
+                failures.append(f"{key}: {members_per_sec:,.0f} members/s is below baseline floor {floor:,.0f}")
+            elif members_per_sec < args.min_members_per_sec:
+                failures.append(f"{key}: {members_per_sec:,.0f} members/s is below the minimum "
+                                f"{args.min_members_per_sec:,.0f}")
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {BASELINE_FILE}")
+    elif not baseline:
+        print("No baseline stored yet (run with --save-baseline); only the minimum of "
+              f"{args.min_members_per_sec:,.0f} members/s is checked.")
+
+    for failure in failures:
+        print("FAIL", failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
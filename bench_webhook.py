@@ -0,0 +1,120 @@
+"""
+Polling vs webhook benchmark against a local fake Telegram Bot API.
+
+Starts an in-process stand-in for api.telegram.org, points the bot at it through
+TELEGRAM_API_URL and pushes the same burst of /start updates through every mode:
+polling (fake getUpdates), webhook/sequential and webhook/concurrent (HTTP POSTs
+with the secret token header). Latency is measured from the moment an update is
+handed to "Telegram" until the bot's reply reaches it.
+
+    python bench_webhook.py                        # 1000 updates, all modes
+    python bench_webhook.py --updates 5000 --connections 40 --modes webhook-concurrent
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession
+
+FAKE_API_PORT = 18081
+WEBHOOK_PORT = 18080
+SECRET = "bench-secret"
+MODES = ["polling", "webhook-sequential", "webhook-concurrent"]
+
+_tmpdir = tempfile.mkdtemp(prefix="bench_webhook_")
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("DB_URL", f"sqlite+aiosqlite:///{os.path.join(_tmpdir, 'bench.db')}")
+os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{FAKE_API_PORT}"
+
+import bot as app  # noqa: E402  (needs the environment above)
+import webhook  # noqa: E402
+from fake_telegram import FakeTelegram, make_updates  # noqa: E402
+
+
+async def run_polling(fake, updates):
+    task = asyncio.create_task(app.dp.start_polling(
+        app.bot, polling_timeout=1, handle_signals=False, close_bot_session=False))
+    await asyncio.sleep(0.2)
+    fake.push(updates)
+    await fake.all_done.wait()
+    await app.dp.stop_polling()
+    await task
+
+
+async def run_webhook(fake, updates, handling, connections):
+    stop = asyncio.Event()
+    server = asyncio.create_task(webhook.run_webhook(
+        app.dp, app.bot, stop_event=stop, host="127.0.0.1", port=WEBHOOK_PORT,
+        secret=SECRET, handling=handling))
+    await asyncio.sleep(0.2)
+    url = f"http://127.0.0.1:{WEBHOOK_PORT}{webhook.WEBHOOK_PATH}"
+    headers = {webhook.SECRET_HEADER: SECRET}
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    async def connection(session):
+        # Telegram keeps up to `max_connections` requests in flight per bot
+        while not queue.empty():
+            update = queue.get_nowait()
+            fake.sent_at[update["message"]["chat"]["id"]] = time.perf_counter()
+            async with session.post(url, data=json.dumps(update), headers=headers) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"webhook answered {resp.status}")
+
+    async with ClientSession(headers={"Content-Type": "application/json"}) as session:
+        async with session.post(url, data="{}", headers={webhook.SECRET_HEADER: "wrong"}) as resp:
+            assert resp.status == 401, "secret token check is not enforced"
+        await asyncio.gather(*(connection(session) for _ in range(connections)))
+    await fake.all_done.wait()
+    stop.set()
+    await server
+
+
+def report(mode, fake, count):
+    latencies = sorted(fake.done_at[c] - fake.sent_at[c] for c in fake.done_at)
+    elapsed = max(fake.done_at.values()) - min(fake.sent_at.values())
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(f"{mode:<22}{count:>8}{count / elapsed:>12,.0f}"
+          f"{statistics.median(latencies) * 1000:>10.1f}{p95 * 1000:>10.1f}{latencies[-1] * 1000:>10.1f}")
+
+
+async def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--updates", type=int, default=1000)
+    ap.add_argument("--connections", type=int, default=40, help="concurrent webhook POSTs (Telegram's max_connections)")
+    ap.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    args = ap.parse_args(argv)
+    logging.disable(logging.WARNING)
+
+    fake = FakeTelegram()
+    runner = await fake.serve("127.0.0.1", FAKE_API_PORT)
+    await app.init_db()
+
+    print(f"{'mode':<22}{'updates':>8}{'upd/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    next_id = 1
+    try:
+        for mode in args.modes:
+            updates = make_updates(args.updates, next_id)
+            next_id += args.updates
+            fake.reset(args.updates)
+            if mode == "polling":
+                await run_polling(fake, updates)
+            else:
+                await run_webhook(fake, updates, mode.split("-", 1)[1], args.connections)
+            report(mode, fake, args.updates)
+    finally:
+        await app.storage.close()
+        await app.bot.session.close()
+        await runner.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,41 +1,57 @@
+import sys
+# Must run before the imports below so their cost shows up in the report
+if __name__ == "__main__" and "--profile-startup" in sys.argv:
+    import startup_profile
+    startup_profile.install()
+else:
+    startup_profile = None
+
 import asyncio
-import logging
 import csv
-import os
+import io
+import logging
+from functools import lru_cache
 from datetime import datetime
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
-from aiogram.utils.keyboard import InlineKeyboardBuilder
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from aiogram.types import BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, InlineQueryResultArticle, InputTextMessageContent
 
-from config import BOT_TOKEN, ADMIN_IDS
-from db import init_db, async_session, Account, Member, Package, Payment
+from config import BOT_TOKEN, ADMIN_IDS, DB_EXPLAIN_ON_START, PAGE_SIZE, MEMBERS_PAGE_SIZE, BOT_MODE, TELEGRAM_API_URL, LOG_FILE, EXPIRY_SWEEP_MINUTES
+from db import init_db, explain_hot_queries, fetch_page, reencrypt_credentials, async_session, Account, Member
 from sqlalchemy import select
-from parser import parse_members_text
-
-# Advanced Logging Setup
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-log_file = os.path.join(log_dir, f"bot_{datetime.now().strftime('%Y%m%d')}.log")
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+import importer
+import onboarding
+import cache
+from fsm_storage import make_storage
+import reminders
+import outbox
+import rollups
+import payments as payment_queue
+import allocator
+import expiry
+import metrics
+import render
+import search
+from log_setup import setup_logging, stop_logging
+
 logger = logging.getLogger(__name__)
 
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+def make_bot():
+    if TELEGRAM_API_URL:
+        return Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+    return Bot(token=BOT_TOKEN)
+
+bot = make_bot()
+storage = make_storage()
 dp = Dispatcher(storage=storage)
-scheduler = AsyncIOScheduler()
+scheduler = None  # created by setup_scheduler(); APScheduler is imported there
+outbound = outbox.Outbox(bot)
+seat_allocator = allocator.SeatAllocator()
+metrics.install(dp, bot)
 
 # States
 class AddAccountState(StatesGroup):
@@ -60,10 +76,16 @@ class PaymentFlow(StatesGroup):
     waiting_for_package = State()
     waiting_for_receipt = State()
 
+class OnboardState(StatesGroup):
+    uploading = State()
+
 class ImportState(StatesGroup):
     picking_account = State()
     pasting_text = State()
 
+class SearchState(StatesGroup):
+    query = State()
+
 class AddMemberManual(StatesGroup):
     account_id = State()
     name = State()
@@ -81,19 +103,43 @@ def get_days_since(dt):
 def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
-# Keyboards
+def page_cursor(data):
+    # "<prefix>_n_<id>" -> page after id, "<prefix>_p_<id>" -> page before id, else first page
+    parts = data.rsplit("_", 2)
+    if len(parts) == 3 and parts[1] in ("n", "p") and parts[2].isdigit():
+        cursor = int(parts[2])
+        return (cursor, None) if parts[1] == "n" else (None, cursor)
+    return None, None
+
+def chunk_text(lines, limit=4000):
+    """Joins lines into messages that stay under Telegram's 4096 character limit."""
+    chunks, current = [], ""
+    for line in lines:
+        if current and len(current) + len(line) > limit:
+            chunks.append(current)
+            current = ""
+        current += line[:limit]
+    if current:
+        chunks.append(current)
+    return chunks
+
+# Keyboards (static ones are built once and shared; never mutate a returned markup)
+@lru_cache(maxsize=None)
 def main_menu_kb():
     kb = [
         [InlineKeyboardButton(text="📂 اکانت‌ها", callback_data="list_accounts")],
         [InlineKeyboardButton(text="📥 وارد کردن اعضا (Paste)", callback_data="import_start")],
         [InlineKeyboardButton(text="💎 مدیریت پکیج‌ها", callback_data="manage_packages")],
-        [InlineKeyboardButton(text="💳 تایید فیش‌ها", callback_data="review_payments")],
+        [InlineKeyboardButton(text="💳 تایید فیش‌ها", callback_data="review_payments"),
+         InlineKeyboardButton(text="🔎 جستجو", callback_data="search_member")],
         [InlineKeyboardButton(text="👤 ثبت کاربر", callback_data="register_client"),
          InlineKeyboardButton(text="⏳ انقضا", callback_data="expiry_status")],
-        [InlineKeyboardButton(text="📤 خروجی CSV", callback_data="export_csv")]
+        [InlineKeyboardButton(text="📤 خروجی CSV", callback_data="export_csv"),
+         InlineKeyboardButton(text="📈 آمار", callback_data="stats")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+@lru_cache(maxsize=None)
 def user_main_kb():
     kb = [
         [InlineKeyboardButton(text="👤 اکانت من", callback_data="my_account")],
@@ -102,15 +148,17 @@ def user_main_kb():
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+@lru_cache(maxsize=None)
 def back_to_main_kb():
     return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ بازگشت", callback_data="main_menu")]])
 
-def payment_review_kb(pay_id):
-    kb = [
-        [InlineKeyboardButton(text="✅ تایید", callback_data=f"approve_{pay_id}"),
-         InlineKeyboardButton(text="❌ رد", callback_data=f"reject_{pay_id}")]
-    ]
-    return InlineKeyboardMarkup(inline_keyboard=kb)
+def pager_row(prefix, rows, has_prev, has_next):
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton(text="◀️ قبلی", callback_data=f"{prefix}_p_{rows[0].id}"))
+    if has_next:
+        row.append(InlineKeyboardButton(text="بعدی ▶️", callback_data=f"{prefix}_n_{rows[-1].id}"))
+    return [row] if row else []
 
 # Handlers
 @dp.message(Command("start"))
@@ -129,12 +177,12 @@ async def back_main(callback: types.CallbackQuery):
     logger.debug(f"User {user_id} returned to main menu")
     
     if is_admin(user_id):
-        await callback.message.edit_text("🚀 **پنل مدیریت GPT Admin**", reply_markup=main_menu_kb())
+        await render.edit(callback.message, "🚀 **پنل مدیریت GPT Admin**", reply_markup=main_menu_kb())
     else:
-        await callback.message.edit_text("👋 **منوی اصلی**", reply_markup=user_main_kb())
+        await render.edit(callback.message, "👋 **منوی اصلی**", reply_markup=user_main_kb())
     await callback.answer()
 
-@dp.callback_query(F.data == "list_accounts")
+@dp.callback_query((F.data == "list_accounts") | F.data.startswith("accs_"))
 async def list_accounts(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         logger.warning(f"Unauthorized access attempt by {callback.from_user.id}")
@@ -142,18 +190,23 @@ async def list_accounts(callback: types.CallbackQuery):
         return
     
     logger.info(f"Admin {callback.from_user.id} viewing accounts list")
-    async with async_session() as session:
-        accounts = (await session.execute(select(Account))).scalars().all()
+    after, before = page_cursor(callback.data)
     
-    if not accounts:
-        await callback.message.edit_text("📭 هیچ اکانتی ثبت نشده است.", reply_markup=back_to_main_kb())
-    else:
+    async def build():
+        accounts, has_prev, has_next = await cache.get_accounts_page(PAGE_SIZE, after, before)
+        if not accounts:
+            return "📭 هیچ اکانتی ثبت نشده است.", back_to_main_kb()
         kb = []
         for acc in accounts:
             kb.append([InlineKeyboardButton(text=f"👑 {acc.account_label or acc.owner_email[:20]}", callback_data=f"view_acc_{acc.id}")])
-        kb.append([InlineKeyboardButton(text="➕ افزودن اکانت", callback_data="add_account_new")])
+        kb += pager_row("accs", accounts, has_prev, has_next)
+        kb.append([InlineKeyboardButton(text="➕ افزودن اکانت", callback_data="add_account_new"),
+                   InlineKeyboardButton(text="📥 افزودن گروهی", callback_data="onboard_accounts")])
         kb.append([InlineKeyboardButton(text="⬅️ بازگشت", callback_data="main_menu")])
-        await callback.message.edit_text("📂 **لیست اکانت‌ها:**", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+        return "📂 **لیست اکانت‌ها:**", InlineKeyboardMarkup(inline_keyboard=kb)
+    
+    text, kb = await render.screen(("accounts", after, before), ("accounts",), build)
+    await render.edit(callback.message, text, reply_markup=kb)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("view_acc_"))
@@ -167,7 +220,6 @@ async def view_account(callback: types.CallbackQuery):
     
     async with async_session() as session:
         acc = await session.get(Account, acc_id)
-        members_count = len((await session.execute(select(Member).where(Member.account_id == acc_id))).scalars().all())
     
     if not acc:
         await callback.answer("❌ اکانت یافت نشد", show_alert=True)
@@ -181,39 +233,49 @@ async def view_account(callback: types.CallbackQuery):
         f"🔐 پسورد: `{acc.login_password or 'ندارد'}`\n\n"
         f"⏳ انقضا: {acc.cycle_end.strftime('%Y-%m-%d') if acc.cycle_end else 'نامشخص'} ({left} روز)\n"
         f"💺 ظرفیت: {acc.seats_total}\n"
-        f"👥 اعضای ثبت شده: {members_count}"
+        f"👥 اعضای ثبت شده: {acc.members_count}\n"
+        f"🪑 صندلی خالی: {acc.free_seats}"
     )
     
     kb = [
         [InlineKeyboardButton(text="👥 لیست اعضا", callback_data=f"members_{acc_id}"),
          InlineKeyboardButton(text="➕ افزودن عضو", callback_data=f"add_member_{acc_id}")],
+        [InlineKeyboardButton(text="📤 خروجی اعضا (CSV)", callback_data=f"exp_csv_{acc_id}")],
         [InlineKeyboardButton(text="⬅️ بازگشت", callback_data="list_accounts")]
     ]
     
-    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="Markdown")
+    await render.edit(callback.message, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="Markdown")
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("members_"))
+@dp.callback_query(F.data.startswith("members_") | F.data.startswith("mpage_"))
 async def list_members(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ دسترسی ندارید", show_alert=True)
         return
     
     acc_id = int(callback.data.split("_")[1])
+    after, before = page_cursor(callback.data)
     logger.info(f"Admin viewing members of account {acc_id}")
     
     async with async_session() as session:
-        members = (await session.execute(select(Member).where(Member.account_id == acc_id))).scalars().all()
+        stmt = select(Member).where(Member.account_id == acc_id)
+        members, has_prev, has_next = await fetch_page(session, stmt, Member.id, MEMBERS_PAGE_SIZE, after, before)
+        acc = await session.get(Account, acc_id)
     
     if not members:
-        await callback.message.edit_text("📭 هیچ عضوی ثبت نشده.", reply_markup=back_to_main_kb())
+        await render.edit(callback.message, "📭 هیچ عضوی ثبت نشده.", reply_markup=back_to_main_kb())
     else:
-        text = f"👥 **اعضای اکانت:**\n\n"
+        lines = [f"👥 **اعضای اکانت ({acc.members_count if acc else len(members)}):**\n\n"]
         for m in members:
             days = get_days_since(m.date_added)
-            text += f"• {m.name} - {m.email}\n  📅 {days} روز پیش\n\n"
+            lines.append(f"• {m.name} - {m.email}\n  📅 {days} روز پیش\n\n")
         
-        await callback.message.edit_text(text, reply_markup=back_to_main_kb(), parse_mode="Markdown")
+        kb = pager_row(f"mpage_{acc_id}", members, has_prev, has_next)
+        kb.append([InlineKeyboardButton(text="⬅️ بازگشت", callback_data=f"view_acc_{acc_id}")])
+        first, *rest = chunk_text(lines)
+        for extra in rest:
+            await callback.message.answer(extra, parse_mode="Markdown")
+        await render.edit(callback.message, first, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="Markdown")
     await callback.answer()
 
 @dp.callback_query(F.data == "add_account_new")
@@ -223,7 +285,7 @@ async def add_account_start(callback: types.CallbackQuery, state: FSMContext):
         return
     
     logger.info(f"Admin {callback.from_user.id} starting to add new account")
-    await callback.message.edit_text("📧 ایمیل مالک اکانت را وارد کنید:")
+    await render.edit(callback.message, "📧 ایمیل مالک اکانت را وارد کنید:")
     await state.set_state(AddAccountState.email)
     await callback.answer()
 
@@ -307,28 +369,119 @@ async def add_acc_finish(message: types.Message, state: FSMContext):
     await message.answer("✅ اکانت با موفقیت ثبت شد.", reply_markup=main_menu_kb())
     await state.clear()
 
+# Bulk account onboarding (CSV/JSON upload)
+ONBOARD_HELP = (
+    "📥 **افزودن گروهی اکانت‌ها**\n\n"
+    "یک فایل .csv یا .json بفرستید. ستون‌ها:\n"
+    "`owner_email` (الزامی)، `account_label`، `login_email`، `login_password`، `billing_email`، "
+    "`activated_at`، `cycle_start`، `cycle_end` (YYYY-MM-DD)، `seats_total`، `status`، `notes`\n\n"
+    "🔄 اکانت‌هایی که `owner_email` آن‌ها از قبل ثبت شده به‌روزرسانی می‌شوند (فقط ستون‌های پر شده)."
+)
+
+@dp.callback_query(F.data == "onboard_accounts")
+async def onboard_start(callback: types.CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ دسترسی ندارید", show_alert=True)
+        return
+    await state.set_state(OnboardState.uploading)
+    await render.edit(callback.message, ONBOARD_HELP, reply_markup=back_to_main_kb(), parse_mode="Markdown")
+    await callback.answer()
+
+@dp.message(Command("onboard"))
+async def onboard_command(message: types.Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return
+    await state.set_state(OnboardState.uploading)
+    await message.answer(ONBOARD_HELP, parse_mode="Markdown")
+
+def format_onboard_report(report, limit=10):
+    errors = report["errors"]
+    lines = [
+        "✅ افزودن گروهی انجام شد.\n\n"
+        f"➕ اکانت جدید: {report['created']}\n"
+        f"🔄 به‌روزرسانی: {report['updated']}\n"
+        f"▫️ بدون تغییر: {report['unchanged']}\n"
+        f"❌ ردیف‌های رد شده: {len(errors)} از {report['rows']}"
+    ]
+    lines += [f"\n  • ردیف {number} {email}: {reason}" for number, email, reason in errors[:limit]]
+    if len(errors) > limit:
+        lines.append(f"\n  … و {len(errors) - limit} مورد دیگر (فایل پیوست)")
+    return "".join(lines)
+
+def onboard_errors_csv(errors):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["row", "owner_email", "error"])
+    writer.writerows(errors)
+    return BufferedInputFile(buffer.getvalue().encode("utf-8-sig"), filename="onboarding_errors.csv")
+
+@dp.message(OnboardState.uploading)
+async def onboard_upload(message: types.Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return
+    kind = onboarding.detect_kind(message.document.file_name) if message.document else None
+    if not kind:
+        await message.answer("❌ فایل .csv یا .json اکانت‌ها را بفرستید.")
+        return
+    
+    logger.info(f"Admin {message.from_user.id} onboarding accounts from {message.document.file_name}")
+    try:
+        raw = (await bot.download(message.document)).getvalue()
+        report = await onboarding.onboard_accounts(raw, kind)
+    except Exception as e:
+        logger.error(f"Account onboarding failed: {e}")
+        await message.answer(f"❌ خطا در پردازش (هیچ تغییری ذخیره نشد): {str(e)}", reply_markup=main_menu_kb())
+        await state.clear()
+        return
+    
+    if report["created"] or report["updated"]:
+        # Bulk writes bypass the ORM hooks that re-queue reminders for single accounts
+        await reminder_engine.rebuild()
+    await message.answer(format_onboard_report(report), reply_markup=main_menu_kb())
+    if len(report["errors"]) > 10:
+        await message.answer_document(onboard_errors_csv(report["errors"]), caption="📄 گزارش خطاهای ردیف‌ها")
+    await state.clear()
+
+def format_sync_report(diff, limit=10):
+    def sample(items):
+        shown = "\n".join(f"  • {item}" for item in items[:limit])
+        more = f"\n  … و {len(items) - limit} مورد دیگر" if len(items) > limit else ""
+        return f"\n{shown}{more}" if items else ""
+    
+    changed = [f"{email}: {old} ← {new}" for email, old, new in diff['role_changed']]
+    return (
+        "✅ همگام‌سازی اعضا انجام شد.\n\n"
+        f"➕ اضافه شده: {len(diff['added'])}{sample(diff['added'])}\n"
+        f"➖ حذف شده: {len(diff['removed'])}{sample(diff['removed'])}\n"
+        f"🔄 تغییر نقش: {len(changed)}{sample(changed)}\n"
+        + (f"♻️ فعال‌شده دوباره: {len(diff['revived'])}{sample(diff['revived'])}\n" if diff.get("revived") else "")
+        + f"▫️ بدون تغییر: {diff['unchanged']}"
+        + (f"\n🎫 بدون ایمیل (دست نخورده): {diff['no_email']}" if diff.get("no_email") else "")
+    )
+
 # Import Members (Bulk)
-@dp.callback_query(F.data == "import_start")
+@dp.callback_query((F.data == "import_start") | F.data.startswith("impacc_"))
 async def import_start(callback: types.CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ دسترسی ندارید", show_alert=True)
         return
     
     logger.info(f"Admin {callback.from_user.id} starting bulk import")
-    async with async_session() as session:
-        accounts = (await session.execute(select(Account))).scalars().all()
+    after, before = page_cursor(callback.data)
+    accounts, has_prev, has_next = await cache.get_accounts_page(PAGE_SIZE, after, before)
     
     if not accounts:
-        await callback.message.edit_text("❌ ابتدا یک اکانت ایجاد کنید.", reply_markup=back_to_main_kb())
+        await render.edit(callback.message, "❌ ابتدا یک اکانت ایجاد کنید.", reply_markup=back_to_main_kb())
         await callback.answer()
         return
     
     kb = []
     for acc in accounts:
         kb.append([InlineKeyboardButton(text=f"{acc.account_label}", callback_data=f"import_to_{acc.id}")])
+    kb += pager_row("impacc", accounts, has_prev, has_next)
     kb.append([InlineKeyboardButton(text="⬅️ انصراف", callback_data="main_menu")])
     
-    await callback.message.edit_text("📥 **اکانت مقصد را انتخاب کنید:**", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+    await render.edit(callback.message, "📥 **اکانت مقصد را انتخاب کنید:**", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("import_to_"))
@@ -341,10 +494,12 @@ async def import_select_account(callback: types.CallbackQuery, state: FSMContext
     await state.update_data(target_account=acc_id)
     await state.set_state(ImportState.pasting_text)
     
-    await callback.message.edit_text(
+    await render.edit(callback.message,
         "📋 **حالا متن اعضا را کپی و پیست کنید:**\n\n"
         "مثال:\n"
-        "John Doe - john@example.com - Member - Added 2 days ago"
+        "John Doe - john@example.com - Member - Added 2 days ago\n\n"
+        "📎 برای لیست‌های بزرگ می‌توانید فایل .txt / .csv / .html هم بفرستید.\n"
+        "🔄 لیست ارسالی با اعضای فعلی اکانت همگام می‌شود (افزودن، حذف و تغییر نقش)."
     )
     await callback.answer()
 
@@ -358,57 +513,156 @@ async def import_process_text(message: types.Message, state: FSMContext):
     
     logger.info(f"Admin {message.from_user.id} importing members to account {acc_id}")
     
+    if message.document:
+        kind = importer.detect_kind(message.document.file_name)
+        if not kind:
+            await message.answer("❌ فقط فایل‌های .txt / .csv / .html پشتیبانی می‌شوند.")
+            return
+    elif message.text:
+        kind = importer.TEXT
+    else:
+        await message.answer("❌ متن یا فایل اعضا را بفرستید.")
+        return
+    
     try:
-        members_data = parse_members_text(message.text)
+        if message.document:
+            raw = (await bot.download(message.document)).getvalue()
+        else:
+            raw = message.text
         
-        async with async_session() as session:
-            for m_data in members_data:
-                member = Member(
-                    account_id=acc_id,
-                    name=m_data.get('name', 'Unknown'),
-                    email=m_data.get('email'),
-                    role=m_data.get('role', 'Member'),
-                    date_added=m_data.get('date_added', datetime.utcnow()),
-                    status="Active"
-                )
-                session.add(member)
-            await session.commit()
+        # Parsing runs in worker processes and only the delta is written, so the loop stays free
+        diff = await importer.sync_members(acc_id, raw, kind)
         
-        await message.answer(f"✅ {len(members_data)} عضو با موفقیت وارد شدند.", reply_markup=main_menu_kb())
-        logger.info(f"Successfully imported {len(members_data)} members")
+        await message.answer(format_sync_report(diff), reply_markup=main_menu_kb())
+        logger.info(f"Successfully synced members: +{len(diff['added'])} -{len(diff['removed'])}")
     except Exception as e:
         logger.error(f"Import failed: {e}")
         await message.answer(f"❌ خطا در پردازش: {str(e)}", reply_markup=main_menu_kb())
     
     await state.clear()
 
+# Search
+def format_search_hit(hit):
+    if hit["kind"] == search.ACCOUNT:
+        return f"👑 {hit['name'] or '-'} — {hit['email']}"
+    tg = f" | 🆔 {hit['telegram_id']}" if hit["telegram_id"] else ""
+    return f"👤 {hit['name']} — {hit['email']}{tg} | 📁 {hit['account_label'] or '-'}"
+
+async def send_search_results(message, query):
+    hits = await search.search(query)
+    if not hits:
+        await message.answer("🔎 نتیجه‌ای پیدا نشد.", reply_markup=back_to_main_kb())
+        return
+    lines = [f"🔎 نتایج «{query}»:\n\n"] + [f"{i}. {format_search_hit(h)}\n" for i, h in enumerate(hits, 1)]
+    kb = []
+    for acc_id in dict.fromkeys(h["account_id"] for h in hits if h["account_id"]):
+        label = next(h["account_label"] for h in hits if h["account_id"] == acc_id)
+        kb.append([InlineKeyboardButton(text=f"📁 {label or acc_id}", callback_data=f"view_acc_{acc_id}")])
+    kb.append([InlineKeyboardButton(text="⬅️ بازگشت", callback_data="main_menu")])
+    await message.answer("".join(lines), reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+
+@dp.callback_query(F.data == "search_member")
+async def search_member(callback: types.CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ دسترسی ندارید", show_alert=True)
+        return
+    await state.set_state(SearchState.query)
+    await render.edit(callback.message, "🔎 نام، ایمیل، آیدی تلگرام یا نام اکانت را بفرستید:", reply_markup=back_to_main_kb())
+    await callback.answer()
+
+@dp.message(SearchState.query)
+async def search_query(message: types.Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        return
+    await state.clear()
+    await send_search_results(message, message.text or "")
+
+@dp.message(Command("search"))
+async def search_command(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    query = (message.text or "").split(maxsplit=1)[1:]
+    if not query:
+        await message.answer("مثال: /search john@example.com")
+        return
+    await send_search_results(message, query[0])
+
+@dp.inline_query()
+async def search_inline(inline_query: types.InlineQuery):
+    if not is_admin(inline_query.from_user.id):
+        await inline_query.answer([], cache_time=300, is_personal=True)
+        return
+    hits = await search.search(inline_query.query)
+    results = [
+        InlineQueryResultArticle(
+            id=f"{hit['kind']}_{hit['id']}",
+            title=hit["name"] or hit["email"] or "-",
+            description=format_search_hit(hit),
+            input_message_content=InputTextMessageContent(message_text=format_search_hit(hit)),
+        )
+        for hit in hits
+    ]
+    await inline_query.answer(results, cache_time=5, is_personal=True)
+
 # Export CSV
+@lru_cache(maxsize=None)
+def export_format_kb(suffix=""):
+    kb = [
+        [InlineKeyboardButton(text="📄 CSV", callback_data=f"exp_csv{suffix}"),
+         InlineKeyboardButton(text="🗜 GZIP", callback_data=f"exp_gz{suffix}"),
+         InlineKeyboardButton(text="📦 ZIP", callback_data=f"exp_zip{suffix}")],
+        [InlineKeyboardButton(text="⬅️ بازگشت", callback_data="main_menu")]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
 @dp.callback_query(F.data == "export_csv")
 async def export_csv(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ دسترسی ندارید", show_alert=True)
         return
     
-    logger.info(f"Admin {callback.from_user.id} exporting CSV")
+    await render.edit(callback.message,
+        "📤 **فرمت خروجی را انتخاب کنید:**\n\n"
+        "برای فیلتر بازه زمانی:\n`/export csv|gz|zip [acc=ID] [from=YYYY-MM-DD] [to=YYYY-MM-DD]`",
+        reply_markup=export_format_kb(), parse_mode="Markdown"
+    )
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("exp_"))
+async def export_run(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ دسترسی ندارید", show_alert=True)
+        return
     
-    async with async_session() as session:
-        accounts = (await session.execute(select(Account))).scalars().all()
-        members = (await session.execute(select(Member))).scalars().all()
+    # exp_<fmt> or exp_<fmt>_<account_id>
+    parts = callback.data.split("_")
+    fmt = parts[1]
+    acc_id = int(parts[2]) if len(parts) > 2 else None
+    logger.info(f"Admin {callback.from_user.id} exporting {fmt} (account={acc_id})")
     
-    csv_file = f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    await callback.answer("⏳ در حال آماده‌سازی خروجی...")
+    import export
+    await export.send_export(callback.message, fmt, account_id=acc_id)
+
+@dp.message(Command("export"))
+async def export_command(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
     
-    with open(csv_file, 'w', newline='', encoding='utf-8-sig') as f:
-        writer = csv.writer(f)
-        writer.writerow(['Account', 'Member Name', 'Email', 'Role', 'Status', 'Date Added'])
-        
-        for m in members:
-            acc = next((a for a in accounts if a.id == m.account_id), None)
-            acc_label = acc.account_label if acc else 'N/A'
-            writer.writerow([acc_label, m.name, m.email, m.role, m.status, m.date_added.strftime('%Y-%m-%d')])
+    import export
+    args = message.text.split()[1:]
+    fmt = args.pop(0) if args and args[0] in export.FORMATS else "csv"
+    try:
+        opts = dict(arg.split("=", 1) for arg in args)
+        acc_id = int(opts["acc"]) if "acc" in opts else None
+        date_from = datetime.strptime(opts["from"], "%Y-%m-%d") if "from" in opts else None
+        date_to = datetime.strptime(opts["to"], "%Y-%m-%d") if "to" in opts else None
+    except (ValueError, KeyError):
+        await message.answer("❌ فرمت اشتباه. مثال: /export gz acc=3 from=2025-01-01 to=2025-02-01")
+        return
     
-    await callback.message.answer_document(FSInputFile(csv_file), caption="📊 خروجی CSV")
-    os.remove(csv_file)
-    await callback.answer()
+    logger.info(f"Admin {message.from_user.id} exporting {fmt} (account={acc_id}, {date_from} - {date_to})")
+    await export.send_export(message, fmt, account_id=acc_id, date_from=date_from, date_to=date_to)
 
 @dp.callback_query(F.data == "expiry_status")
 async def expiry_status(callback: types.CallbackQuery):
@@ -416,16 +670,19 @@ async def expiry_status(callback: types.CallbackQuery):
         await callback.answer("❌ دسترسی ندارید", show_alert=True)
         return
     
-    async with async_session() as session:
-        accounts = (await session.execute(select(Account).order_by(Account.cycle_end))).scalars().all()
-    
-    text = "⏳ **وضعیت انقضا:**\n\n"
-    for acc in accounts:
-        left = get_days_left(acc.cycle_end)
-        icon = "🟢" if left > 7 else "🟡" if left > 0 else "🔴"
-        text += f"{icon} {acc.account_label}: {left} روز\n"
+    async def build():
+        # Same order as ORDER BY cycle_end in SQLite: accounts without a date first
+        accounts = sorted(await cache.get_accounts(), key=lambda a: (a.cycle_end is not None, a.cycle_end or datetime.min))
+        text = "⏳ **وضعیت انقضا:**\n\n"
+        for acc in accounts:
+            left = get_days_left(acc.cycle_end)
+            icon = "🟢" if left > 7 else "🟡" if left > 0 else "🔴"
+            text += f"{icon} {acc.account_label}: {left} روز\n"
+        return text, back_to_main_kb()
     
-    await callback.message.edit_text(text, reply_markup=back_to_main_kb(), parse_mode="Markdown")
+    # Days left change at midnight, so the date is part of the key
+    text, kb = await render.screen(("expiry", datetime.now().date()), ("accounts",), build)
+    await render.edit(callback.message, text, reply_markup=kb, parse_mode="Markdown")
     await callback.answer()
 
 @dp.callback_query(F.data == "manage_packages")
@@ -434,103 +691,363 @@ async def manage_packages(callback: types.CallbackQuery):
         await callback.answer("❌ دسترسی ندارید", show_alert=True)
         return
     
-    async with async_session() as session:
-        pkgs = (await session.execute(select(Package))).scalars().all()
-    
-    kb = []
-    for pkg in pkgs:
-        kb.append([InlineKeyboardButton(text=f"{pkg.name} - {pkg.price}", callback_data=f"pkg_{pkg.id}")])
-    kb.append([InlineKeyboardButton(text="➕ افزودن پکیج", callback_data="add_pkg")])
-    kb.append([InlineKeyboardButton(text="⬅️ بازگشت", callback_data="main_menu")])
+    async def build():
+        kb = []
+        for pkg in await cache.get_packages():
+            kb.append([InlineKeyboardButton(text=f"{pkg.name} - {pkg.price}", callback_data=f"pkg_{pkg.id}")])
+        kb.append([InlineKeyboardButton(text="➕ افزودن پکیج", callback_data="add_pkg")])
+        kb.append([InlineKeyboardButton(text="⬅️ بازگشت", callback_data="main_menu")])
+        return "💎 **مدیریت پکیج‌ها:**", InlineKeyboardMarkup(inline_keyboard=kb)
     
-    await callback.message.edit_text("💎 **مدیریت پکیج‌ها:**", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+    text, kb = await render.screen(("packages",), ("packages",), build)
+    await render.edit(callback.message, text, reply_markup=kb)
     await callback.answer()
 
-@dp.callback_query(F.data == "review_payments")
+def review_page_kb(payments):
+    # One compact keyboard for the whole media group (media groups cannot carry buttons)
+    kb = [
+        [InlineKeyboardButton(text=f"✅ #{pay.id}", callback_data=f"approve_{pay.id}"),
+         InlineKeyboardButton(text=f"❌ #{pay.id}", callback_data=f"reject_{pay.id}")]
+        for pay in payments
+    ]
+    kb.append([InlineKeyboardButton(text="بعدی ▶️", callback_data=f"revpage_{payments[-1].id}"),
+               InlineKeyboardButton(text="⬅️ بازگشت", callback_data="revdone")])
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+async def send_review_page(admin_id, payments):
+    captions = [f"📝 فیش #{pay.id}\n👤 کاربر: {pay.user_id}\n💰 {pay.amount or '-'}" for pay in payments]
+    if len(payments) == 1:
+        await outbound.send_photo(admin_id, payments[0].receipt_photo_id, caption=captions[0])
+    else:
+        media = [InputMediaPhoto(media=pay.receipt_photo_id, caption=caption) for pay, caption in zip(payments, captions)]
+        await outbound.submit("send_media_group", admin_id, media=media)
+    await outbound.send_message(admin_id, "👆 تصمیم برای این صفحه:", reply_markup=review_page_kb(payments))
+
+@dp.callback_query((F.data == "review_payments") | F.data.startswith("revpage_"))
 async def review_payments(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ دسترسی ندارید", show_alert=True)
         return
     
-    async with async_session() as session:
-        payments = (await session.execute(select(Payment).where(Payment.status == "Pending"))).scalars().all()
+    admin_id = callback.from_user.id
+    after_id = int(callback.data.split("_")[1]) if callback.data.startswith("revpage_") else None
+    # Locks of the previous page go back to the pool before the next page is claimed
+    await payment_queue.release_reviews(admin_id)
+    payments, total = await payment_queue.claim_review_page(admin_id, after_id)
     
     if not payments:
-        await callback.message.edit_text("✅ فیشی در انتظار نیست.", reply_markup=back_to_main_kb())
+        text = "✅ فیشی در انتظار نیست." if not total else f"⏳ {total} فیش منتظر است ولی همه در حال بررسی توسط ادمین دیگری هستند."
+        await render.edit(callback.message, text, reply_markup=back_to_main_kb())
     else:
-        await callback.message.edit_text(f"⏳ {len(payments)} فیش در انتظار بررسی...")
-        for pay in payments:
-            await bot.send_photo(
-                callback.from_user.id,
-                pay.receipt_photo_id,
-                caption=f"📝 فیش #{pay.id}\n👤 کاربر: {pay.user_id}",
-                reply_markup=payment_review_kb(pay.id)
-            )
+        await render.edit(callback.message, f"⏳ {total} فیش در انتظار بررسی، ارسال {len(payments)} مورد...")
+        try:
+            await send_review_page(admin_id, payments)
+        except Exception as e:
+            logger.error(f"Failed to send review page to {admin_id}: {e}")
+            await payment_queue.release_reviews(admin_id)
     await callback.answer()
 
+def drop_review_row(markup, pay_id):
+    # The decided payment's buttons leave the page keyboard; the other rows stay
+    rows = [row for row in markup.inline_keyboard
+            if not any(b.callback_data in (f"approve_{pay_id}", f"reject_{pay_id}") for b in row)]
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+@dp.callback_query(F.data.startswith("approve_"))
+async def approve_payment(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ دسترسی ندارید", show_alert=True)
+        return
+    
+    pay_id = int(callback.data.split("_")[1])
+    try:
+        result = await seat_allocator.approve(pay_id, callback.from_user.id)
+    except allocator.AllocationError as e:
+        await callback.answer(f"❌ {e}", show_alert=True)
+        return
+    except Exception as e:
+        logger.error(f"Approving payment {pay_id} failed: {e}")
+        await callback.answer("❌ خطا در تایید فیش، دوباره تلاش کنید.", show_alert=True)
+        return
+    
+    label = result.account_label or f"#{result.account_id}"
+    await callback.answer(f"✅ فیش #{pay_id} تایید شد → {label}{' (تمدید)' if result.renewed else ''}")
+    if callback.message.reply_markup:
+        await render.edit(callback.message, callback.message.text or "👆", reply_markup=drop_review_row(callback.message.reply_markup, pay_id))
+    text = "✅ پرداخت شما تایید شد و اشتراک شما تمدید شد." if result.renewed else \
+        "✅ پرداخت شما تایید شد. صندلی شما رزرو شد و به‌زودی دعوت‌نامه ارسال می‌شود."
+    await outbound.broadcast([result.user_id], text, reply_markup=user_main_kb())
+
+@dp.callback_query(F.data.startswith("reject_"))
+async def reject_payment(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ دسترسی ندارید", show_alert=True)
+        return
+    
+    pay_id = int(callback.data.split("_")[1])
+    try:
+        user_id = await payment_queue.reject(pay_id, callback.from_user.id)
+    except Exception as e:
+        logger.error(f"Rejecting payment {pay_id} failed: {e}")
+        await callback.answer("❌ خطا در رد فیش، دوباره تلاش کنید.", show_alert=True)
+        return
+    if user_id is None:
+        await callback.answer("❌ این فیش قبلا بررسی شده یا در دست ادمین دیگری است.", show_alert=True)
+        return
+    
+    await callback.answer(f"❌ فیش #{pay_id} رد شد")
+    if callback.message.reply_markup:
+        await render.edit(callback.message, callback.message.text or "👆", reply_markup=drop_review_row(callback.message.reply_markup, pay_id))
+    await outbound.broadcast([user_id], "❌ پرداخت شما تایید نشد. در صورت نیاز با پشتیبانی تماس بگیرید.", reply_markup=user_main_kb())
+
+@dp.callback_query(F.data == "revdone")
+async def review_done(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ دسترسی ندارید", show_alert=True)
+        return
+    await payment_queue.release_reviews(callback.from_user.id)
+    await render.edit(callback.message, "🚀 **پنل مدیریت GPT Admin**", reply_markup=main_menu_kb())
+    await callback.answer()
+
+@dp.message(Command("cache"))
+async def cache_stats(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    st = cache.stats()
+    await message.answer(
+        "🗄 **کش:**\n\n"
+        f"ورودی‌ها: {st['entries']}\n"
+        f"Hit: {st['hits']} | Miss: {st['misses']} ({st['hit_rate']:.0%})\n"
+        f"حذف (LRU): {st['evictions']}",
+        parse_mode="Markdown"
+    )
+
+@dp.message(Command("stats"))
+async def perf_stats(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    rows = metrics.snapshot()
+    lines = [f"⏱ کارایی (از {datetime.fromtimestamp(metrics.started_at).strftime('%Y-%m-%d %H:%M')})\n\n"]
+    if not rows:
+        lines.append("هنوز آپدیتی ثبت نشده.\n")
+    for r in rows:
+        lines.append(
+            f"{r['handler']}: {r['count']}x | p50 {r['p50'] * 1000:.0f}ms p95 {r['p95'] * 1000:.0f}ms "
+            f"max {r['max'] * 1000:.0f}ms | SQL {r['queries']:.1f}q/{r['sql_time'] * 1000:.0f}ms "
+            f"API {r['api_time'] * 1000:.0f}ms" + (f" | ❌ {r['errors']}" if r['errors'] else "") + "\n"
+        )
+    st = cache.stats()
+    ob = outbound.stats()
+    rs = render.stats()
+    lines.append(f"\n🗄 کش: {st['entries']} ورودی، Hit {st['hit_rate']:.0%}\n")
+    lines.append(f"🖼 ویرایش پیام: {rs['edits']} ارسال، {rs['skipped']} بدون تغییر (رد شد)\n")
+    lines.append(f"📤 صف ارسال: {ob['queued']} در صف، {ob['sent']} ارسال، تاخیر میانگین {ob['avg_latency'] * 1000:.0f}ms\n")
+    for chunk in chunk_text(lines):
+        await message.answer(chunk)
+
+def metrics_extra():
+    # Cache and outbox gauges for the /metrics endpoint
+    st = cache.stats()
+    ob = outbound.stats()
+    return [
+        f"bot_cache_entries {st['entries']}",
+        f"bot_cache_hits_total {st['hits']}",
+        f"bot_cache_misses_total {st['misses']}",
+        f"bot_outbox_queued {ob['queued']}",
+        f"bot_outbox_sent_total {ob['sent']}",
+    ]
+
+@dp.message(Command("rekey"))
+async def rekey(message: types.Message):
+    if not is_admin(message.from_user.id):
+        return
+    logger.info(f"Admin {message.from_user.id} started credential re-encryption")
+    await message.answer("🔐 رمزنگاری مجدد اطلاعات ورود شروع شد...")
+    changed = await reencrypt_credentials()
+    await message.answer(f"✅ رمزنگاری مجدد تمام شد ({changed} اکانت).")
+
 # User handlers
 @dp.callback_query(F.data == "my_account")
 async def my_account(callback: types.CallbackQuery):
-    async with async_session() as session:
-        stmt = select(Member).where(Member.telegram_id == callback.from_user.id)
-        member = (await session.execute(stmt)).scalar()
-        
-        if member and member.account_id:
-            acc = await session.get(Account, member.account_id)
-        else:
-            acc = None
+    member, acc = await cache.get_member_account(callback.from_user.id)
     
     if not member or not acc:
-        await callback.message.edit_text("❌ شما اشتراک فعالی ندارید.", reply_markup=user_main_kb())
+        await render.edit(callback.message, "❌ شما اشتراک فعالی ندارید.", reply_markup=user_main_kb())
     else:
         left = get_days_left(acc.cycle_end)
         text = f"👤 **اکانت شما:**\n\n📧 {member.email}\n⏳ {left} روز باقی‌مانده"
-        await callback.message.edit_text(text, reply_markup=user_main_kb(), parse_mode="Markdown")
+        await render.edit(callback.message, text, reply_markup=user_main_kb(), parse_mode="Markdown")
     await callback.answer()
 
+def format_stats_row(row):
+    return (
+        f"📁 اکانت فعال: {row.accounts_active}\n"
+        f"💺 صندلی‌ها: {row.seats_used} / {row.seats_total}\n"
+        f"💳 فیش: {row.payments_created} جدید، {row.payments_approved} تایید، {row.payments_pending} منتظر\n"
+        f"🧾 فاکتور: {row.invoices_count} ({row.revenue_paid:,.0f} پرداخت از {row.revenue_billed:,.0f})\n"
+    )
+
 async def send_daily_report():
     logger.info("Sending daily report")
-    async with async_session() as session:
-        accs = (await session.execute(select(Account))).scalars().all()
-        pending = (await session.execute(select(Payment).where(Payment.status == "Pending"))).scalars().all()
+    # Gauges are refreshed, everything else is read from the summary rows
+    await rollups.snapshot()
+    days = await rollups.recent_days(2)
+    months = await rollups.recent_months(1)
     
     report = f"📊 **گزارش روزانه**\n📅 {datetime.now().strftime('%Y-%m-%d')}\n\n"
-    report += f"📁 کل اکانت‌ها: {len(accs)}\n"
-    report += f"💳 فیش‌های منتظر: {len(pending)}\n"
+    if days:
+        report += format_stats_row(days[0])
+    if len(days) > 1:
+        report += f"\n📆 دیروز:\n{format_stats_row(days[1])}"
+    if months:
+        report += f"\n🗓 ماه {months[0].month}:\n{format_stats_row(months[0])}"
     
-    for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(admin_id, report, parse_mode="Markdown")
-        except Exception as e:
-            logger.error(f"Failed to send report to {admin_id}: {e}")
+    await outbound.broadcast(ADMIN_IDS, report, priority=outbox.REPORT, parse_mode="Markdown")
 
-async def check_reminders():
-    logger.info("Checking expiry reminders")
-    async with async_session() as session:
-        accs = (await session.execute(select(Account))).scalars().all()
+@dp.callback_query(F.data == "stats")
+async def stats_screen(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ دسترسی ندارید", show_alert=True)
+        return
     
-    for acc in accs:
-        left = get_days_left(acc.cycle_end)
-        if left in [7, 3, 1]:
-            msg = f"⚠️ **هشدار انقضا!**\nاکانت `{acc.account_label}` فقط {left} روز باقی مانده."
-            for admin_id in ADMIN_IDS:
-                try:
-                    await bot.send_message(admin_id, msg, parse_mode="Markdown")
-                except Exception as e:
-                    logger.error(f"Failed to send reminder to {admin_id}: {e}")
+    async def build():
+        days = await rollups.recent_days(7)
+        months = await rollups.recent_months(6)
+        text = "📈 **آمار**\n\n"
+        if days:
+            text += format_stats_row(days[0]) + "\n"
+        text += "📆 ۷ روز اخیر (فیش جدید / تایید / درآمد):\n"
+        for row in days:
+            text += f"`{row.day}` {row.payments_created} / {row.payments_approved} / {row.revenue_paid:,.0f}\n"
+        text += "\n🗓 ماه‌ها (فیش تایید / درآمد):\n"
+        for row in months:
+            text += f"`{row.month}` {row.payments_approved} / {row.revenue_paid:,.0f}\n"
+        return text, back_to_main_kb()
+    
+    # Flow counters are written during payment/invoice flushes, so those tables are deps too
+    text, kb = await render.screen(
+        ("stats", datetime.utcnow().date()), ("stats_daily", "stats_monthly", "payments", "invoices"), build
+    )
+    await render.edit(callback.message, text, reply_markup=kb, parse_mode="Markdown")
+    await callback.answer()
+
+async def send_expiry_reminder(acc, days):
+    msg = f"⚠️ **هشدار انقضا!**\nاکانت `{acc.account_label}` فقط {days} روز باقی مانده."
+    # Raising lets the reminder engine un-claim it and retry on the next rebuild
+    await outbound.broadcast(ADMIN_IDS, msg, priority=outbox.ALERT, raise_errors=True, parse_mode="Markdown")
+
+async def run_expiry_sweep():
+    result = await expiry.sweep()
+    if result["accounts"]:
+        lines = [f"⌛ {len(result['accounts'])} اکانت منقضی شد:\n"]
+        lines += [f"• {label or f'#{acc_id}'}\n" for acc_id, label in result["accounts"]]
+        for chunk in chunk_text(lines):
+            await outbound.broadcast(ADMIN_IDS, chunk, priority=outbox.ALERT)
+    if result["members"]:
+        await outbound.broadcast(result["members"], "⌛ اشتراک شما به پایان رسید. برای تمدید از «🛍 خرید / تمدید» استفاده کنید.",
+                                 reply_markup=user_main_kb())
+
+reminder_engine = reminders.ReminderEngine(send_expiry_reminder)
+reminders.install(reminder_engine)
 
 def setup_scheduler():
+    global scheduler
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    scheduler = AsyncIOScheduler()
     scheduler.add_job(send_daily_report, 'cron', hour=9, minute=0)
-    scheduler.add_job(check_reminders, 'interval', hours=12)
+    scheduler.add_job(rollups.snapshot, 'interval', hours=1)
+    # Reminders fire on their own schedule; this daily rebuild is only a safety net
+    scheduler.add_job(reminder_engine.rebuild, 'cron', hour=0, minute=5)
+    # First sweep right away so statuses are current after downtime
+    scheduler.add_job(run_expiry_sweep, 'interval', minutes=EXPIRY_SWEEP_MINUTES, next_run_time=datetime.now())
     scheduler.start()
     logger.info("Scheduler started")
 
+_running = {}
+
+def _report_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task {task.get_name()} failed", exc_info=task.exception())
+
+def background_task(coro, name):
+    """Starts a fire-and-forget task whose failure is logged as soon as it happens."""
+    task = asyncio.create_task(coro, name=name)
+    task.add_done_callback(_report_failure)
+    return task
+
+async def warm_up(background=True):
+    """
+    Work that can trail update intake: `background` runs the singletons (rollup backfill,
+    scheduler, reminders, rekey); in cluster mode only one worker runs them.
+    """
+    if DB_EXPLAIN_ON_START:
+        await explain_hot_queries()
+    if background:
+        await rollups.backfill()
+        await rollups.snapshot()
+        setup_scheduler()
+        await reminder_engine.start()
+        # Encrypts credentials stored before encryption/rotation; a no-op once everything is current
+        _running["rekey"] = background_task(reencrypt_credentials(), "rekey")
+    _running["metrics"] = await metrics.serve(extra=metrics_extra)
+    # First menu opens are served from cache
+    await cache.get_accounts()
+    await cache.get_packages()
+    logger.info("Warm-up finished")
+
+async def startup(background=True):
+    """
+    Starts everything except update intake. Only the outbox is started inline; the rest
+    runs in a warm-up task so the first getUpdates goes out right away.
+    """
+    outbound.start()
+    _running["warm_up"] = background_task(warm_up(background), "warm_up")
+
+async def shutdown():
+    warming = _running.get("warm_up")
+    if warming and not warming.done():
+        warming.cancel()
+    if _running.get("metrics"):
+        await _running["metrics"].cleanup()
+    if scheduler and scheduler.running:
+        scheduler.shutdown(wait=False)
+    reminder_engine.stop()
+    await outbound.stop()
+    await storage.close()
+    importer.shutdown_pool()
+
 async def main():
+    setup_logging()
     await init_db()
-    setup_scheduler()
+    await startup()
     logger.info("✅ Bot started successfully!")
-    print("✅ Bot started successfully! Logs: " + log_file)
-    await dp.start_polling(bot)
+    print("✅ Bot started successfully! Logs: " + LOG_FILE)
+    try:
+        if BOT_MODE == "webhook":
+            import webhook
+            await webhook.run_webhook(dp, bot)
+        else:
+            # getUpdates is refused while a webhook is registered (e.g. after switching modes)
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await shutdown()
+        stop_logging()
+
+async def profile_startup():
+    """`python bot.py --profile-startup`: import breakdown plus the startup steps, then exit."""
+    with startup_profile.phase("setup_logging"):
+        setup_logging()
+    with startup_profile.phase("init_db"):
+        created = await init_db()
+    startup_profile.mark_ready()
+    with startup_profile.phase("warm_up (after polling starts)"):
+        await warm_up()
+    startup_profile.report()
+    print(f"\nSchema {'created/upgraded' if created else 'already current, DDL skipped'}")
+    await shutdown()
+    await bot.session.close()
+    stop_logging()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(profile_startup() if startup_profile else main())
@@ -0,0 +1,149 @@
+import time
+import logging
+from collections import OrderedDict
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from config import CACHE_MAX_ENTRIES, CACHE_TTL
+from db import async_session, fetch_page, Account, Member, Package
+
+logger = logging.getLogger(__name__)
+
+# --- Entity versions ---
+# Every table has a counter that is bumped when a transaction that wrote to it
+# commits. Cached values remember the versions they were built from and are
+# only served while those versions are still current.
+_versions = {}
+# Called with the touched entities after each local commit (cluster workers relay them)
+listeners = []
+
+def version(entity):
+    return _versions.get(entity, 0)
+
+def bump(*entities):
+    for entity in entities:
+        _versions[entity] = _versions.get(entity, 0) + 1
+
+def _touched(session):
+    return session.info.setdefault("cache_touched", set())
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_statement(orm_execute_state):
+    # Bulk INSERT/UPDATE/DELETE issued through session.execute()
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None:
+            _touched(orm_execute_state.session).add(table.name)
+
+@event.listens_for(Session, "after_flush")
+def _track_flush(session, flush_context):
+    touched = _touched(session)
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(obj, "__table__", None)
+        if table is not None:
+            touched.add(table.name)
+        if isinstance(obj, Member):
+            # Member writes also move Account.members_count
+            touched.add(Account.__tablename__)
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session):
+    touched = session.info.pop("cache_touched", None)
+    if touched:
+        bump(*touched)
+        for listener in listeners:
+            listener(touched)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session):
+    session.info.pop("cache_touched", None)
+
+# --- LRU + TTL store ---
+class VersionedCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, deps):
+        entry = self._data.get(key)
+        if entry is not None:
+            stamp, expires_at, value = entry
+            if stamp == tuple(version(d) for d in deps) and expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, value
+            del self._data[key]
+        self.misses += 1
+        return False, None
+
+    def set(self, key, deps, value, stamp=None):
+        if stamp is None:
+            stamp = tuple(version(d) for d in deps)
+        self._data[key] = (stamp, time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, key, deps, loader):
+        found, value = self.get(key, deps)
+        if found:
+            return value
+        # Stamp with the versions seen before loading so a concurrent commit invalidates the result
+        stamp = tuple(version(d) for d in deps)
+        value = await loader()
+        self.set(key, deps, value, stamp)
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+store = VersionedCache()
+
+def stats():
+    return store.stats()
+
+# --- Cached lookups ---
+async def get_accounts():
+    """All accounts ordered by id (detached objects, read-only)."""
+    async def load():
+        async with async_session() as session:
+            return (await session.execute(select(Account).order_by(Account.id))).scalars().all()
+    return await store.get_or_load("accounts", ("accounts",), load)
+
+async def get_accounts_page(size, after=None, before=None):
+    """One keyset page of accounts: (accounts, has_prev, has_next)."""
+    async def load():
+        async with async_session() as session:
+            return await fetch_page(session, select(Account), Account.id, size, after, before)
+    return await store.get_or_load(("accounts_page", size, after, before), ("accounts",), load)
+
+async def get_packages():
+    async def load():
+        async with async_session() as session:
+            return (await session.execute(select(Package).order_by(Package.id))).scalars().all()
+    return await store.get_or_load("packages", ("packages",), load)
+
+async def get_member_account(telegram_id):
+    """(Member, Account) for a Telegram user; either may be None. Misses are cached too."""
+    async def load():
+        async with async_session() as session:
+            member = (await session.execute(select(Member).where(Member.telegram_id == telegram_id))).scalar()
+            acc = await session.get(Account, member.account_id) if member and member.account_id else None
+            return member, acc
+    return await store.get_or_load(("member_by_tg", telegram_id), ("members", "accounts"), load)
@@ -0,0 +1,357 @@
+"""
+Scale-out mode: one intake process receives updates (polling or webhook) and shards
+them by chat to N worker processes, each running the full dispatcher.
+
+    python cluster.py                  # CLUSTER_WORKERS workers (default: CPU count)
+    python cluster.py --workers 4 --mode webhook
+
+Intake and workers talk newline-delimited JSON over one UNIX socket per worker.
+A chat always lands on the same worker and its updates run there one at a time,
+so per-chat order and the FSM hot layer stay correct. Cache invalidations are
+relayed: every committed write is announced to the intake, which forwards it to
+the other workers in the same stream as their updates. Scheduler, reminders and
+other singletons run on worker 0 only; the outbound rate limit is split evenly.
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+import sys
+from collections import deque
+
+from aiohttp import web, ClientSession, ClientTimeout, ClientError
+
+from config import (
+    BOT_TOKEN, BOT_MODE, TELEGRAM_API_URL, CLUSTER_WORKERS, CLUSTER_SOCKET_DIR, POLLING_TIMEOUT,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_DRAIN_TIMEOUT,
+    OUTBOX_GLOBAL_RATE, METRICS_PORT, LOG_FILE,
+)
+from log_setup import setup_logging, stop_logging
+
+logger = logging.getLogger(__name__)
+
+LINE_LIMIT = 16 * 1024 * 1024  # largest single message on the socket
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+_CHAT_EVENTS = ("message", "edited_message", "channel_post", "edited_channel_post",
+                "business_message", "edited_business_message")
+
+
+def shard_key(update):
+    """Chat id of a raw update (user id for chat-less events like inline queries)."""
+    for field in _CHAT_EVENTS:
+        if field in update:
+            return update[field]["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback:
+        return callback["message"]["chat"]["id"] if callback.get("message") else callback["from"]["id"]
+    for value in update.values():
+        if isinstance(value, dict):
+            if "chat" in value:
+                return value["chat"]["id"]
+            if "from" in value:
+                return value["from"]["id"]
+            if "user" in value:
+                return value["user"]["id"]
+    return 0
+
+
+def socket_path(index, socket_dir=CLUSTER_SOCKET_DIR):
+    return os.path.join(socket_dir, f"worker{index}.sock")
+
+
+def _line(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+
+class ChatQueues:
+    """Runs items of one key strictly in order while different keys run concurrently."""
+
+    def __init__(self, handle):
+        self.handle = handle
+        self._queues = {}
+        self._tasks = set()
+
+    def submit(self, key, item):
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            task = asyncio.create_task(self._run(key, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append(item)
+
+    async def _run(self, key, queue):
+        while queue:
+            item = queue.popleft()
+            try:
+                await self.handle(item)
+            except Exception as e:
+                logger.error(f"Update for chat {key} failed: {e}", exc_info=True)
+        del self._queues[key]
+
+    def pending(self):
+        return sum(len(q) for q in self._queues.values()) + len(self._tasks)
+
+    async def drain(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+# --- Intake ---
+class Intake:
+    def __init__(self, workers, socket_dir=CLUSTER_SOCKET_DIR):
+        self.workers = workers
+        self.socket_dir = socket_dir
+        self.processes = []
+        self._queues = [asyncio.Queue() for _ in range(workers)]
+        self._tasks = []
+        self.forwarded = 0
+
+    def _worker_env(self, index):
+        env = dict(os.environ)
+        env["OUTBOX_GLOBAL_RATE"] = str(OUTBOX_GLOBAL_RATE / self.workers)
+        env["METRICS_PORT"] = str(METRICS_PORT + 1 + index if METRICS_PORT else 0)
+        root, ext = os.path.splitext(LOG_FILE)
+        env["LOG_FILE"] = f"{root}.worker{index}{ext or '.log'}"
+        return env
+
+    async def start(self):
+        os.makedirs(self.socket_dir, exist_ok=True)
+        for index in range(self.workers):
+            path = socket_path(index, self.socket_dir)
+            if os.path.exists(path):
+                os.remove(path)
+            self.processes.append(await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), "--worker", str(index),
+                "--workers", str(self.workers), "--socket-dir", self.socket_dir,
+                env=self._worker_env(index),
+            ))
+        for index in range(self.workers):
+            reader, writer = await self._connect(index)
+            self._tasks.append(asyncio.create_task(self._send(index, writer)))
+            self._tasks.append(asyncio.create_task(self._receive(index, reader)))
+        logger.info(f"Cluster intake connected to {self.workers} workers")
+
+    async def _connect(self, index, timeout=120):
+        path = socket_path(index, self.socket_dir)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            if self.processes[index].returncode is not None:
+                raise RuntimeError(f"Worker {index} exited with code {self.processes[index].returncode}")
+            try:
+                return await asyncio.open_unix_connection(path, limit=LINE_LIMIT)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+    def dispatch(self, update):
+        self._queues[shard_key(update) % self.workers].put_nowait(_line({"update": update}))
+        self.forwarded += 1
+
+    async def _send(self, index, writer):
+        queue = self._queues[index]
+        while True:
+            # Everything already queued goes out with a single drain
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            for line in batch:
+                if line is None:
+                    writer.write_eof()
+                    await writer.drain()
+                    return
+                writer.write(line)
+            await writer.drain()
+
+    async def _receive(self, index, reader):
+        while line := await reader.readline():
+            message = json.loads(line)
+            if "bump" in message:
+                relay = _line(message)
+                for other, queue in enumerate(self._queues):
+                    if other != index:
+                        queue.put_nowait(relay)
+
+    async def stop(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Closes the worker streams, lets the workers drain and exit."""
+        for queue in self._queues:
+            queue.put_nowait(None)
+        waits = [asyncio.wait_for(p.wait(), timeout) for p in self.processes]
+        for process, result in zip(self.processes, await asyncio.gather(*waits, return_exceptions=True)):
+            if isinstance(result, asyncio.TimeoutError):
+                logger.warning(f"Worker {process.pid} did not exit in {timeout}s, terminating")
+                process.terminate()
+                await process.wait()
+        for task in self._tasks:
+            task.cancel()
+
+
+def _api_url(method):
+    base = (TELEGRAM_API_URL or "https://api.telegram.org").rstrip("/")
+    return f"{base}/bot{BOT_TOKEN}/{method}"
+
+
+async def poll(intake, http):
+    """getUpdates loop; the offset only moves past updates already handed to a worker queue."""
+    async with http.post(_api_url("deleteWebhook"), json={}):
+        pass
+    offset = 0
+    while True:
+        try:
+            async with http.post(
+                _api_url("getUpdates"), json={"offset": offset, "timeout": POLLING_TIMEOUT},
+                timeout=ClientTimeout(total=POLLING_TIMEOUT + 10),
+            ) as resp:
+                body = await resp.json()
+        except (ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"getUpdates failed: {e}")
+            await asyncio.sleep(1)
+            continue
+        if not body.get("ok"):
+            retry = body.get("parameters", {}).get("retry_after", 1)
+            logger.warning(f"getUpdates refused: {body.get('description')}, retrying in {retry}s")
+            await asyncio.sleep(retry)
+            continue
+        for update in body["result"]:
+            intake.dispatch(update)
+            offset = update["update_id"] + 1
+
+
+async def serve_webhook(intake, http, secret):
+    async def handle(request):
+        if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        intake.dispatch(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    if WEBHOOK_URL:
+        async with http.post(_api_url("setWebhook"), json={
+            "url": WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, "secret_token": secret,
+        }) as resp:
+            logger.info(f"setWebhook: {(await resp.json()).get('description')}")
+    logger.info(f"Cluster webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_intake(workers, mode=BOT_MODE, socket_dir=CLUSTER_SOCKET_DIR):
+    from db import init_db
+    # Schema changes happen once, before any worker opens the database
+    await init_db()
+    intake = Intake(workers, socket_dir)
+    await intake.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with ClientSession() as http:
+        if mode == "webhook":
+            secret = WEBHOOK_SECRET or (secrets.token_urlsafe(32) if WEBHOOK_URL else "")
+            source = asyncio.create_task(serve_webhook(intake, http, secret))
+        else:
+            source = asyncio.create_task(poll(intake, http))
+        print(f"✅ Cluster started: {workers} workers ({mode})")
+        await asyncio.wait([source, asyncio.create_task(stop.wait())], return_when=asyncio.FIRST_COMPLETED)
+        source.cancel()
+        try:
+            await source
+        except asyncio.CancelledError:
+            pass
+    logger.info(f"Cluster stopping after {intake.forwarded} updates")
+    await intake.stop()
+
+
+# --- Worker ---
+async def run_worker(index, workers, socket_dir=CLUSTER_SOCKET_DIR):
+    import bot as app
+    import cache
+    from aiogram.types import Update
+
+    await app.startup(background=index == 0)
+    done = asyncio.Event()
+    rebuild = {}
+
+    def on_remote_bump(entities):
+        cache.bump(*entities)
+        if index == 0 and "accounts" in entities and not rebuild.get("pending"):
+            # Accounts changed on another worker: refresh the reminder schedule (debounced)
+            rebuild["pending"] = True
+            asyncio.get_running_loop().call_later(1, lambda: asyncio.ensure_future(_rebuild()))
+
+    async def _rebuild():
+        rebuild["pending"] = False
+        await app.reminder_engine.rebuild()
+
+    async def feed(update):
+        await app.dp.feed_update(app.bot, Update.model_validate(update, context={"bot": app.bot}))
+
+    chats = ChatQueues(feed)
+
+    async def handle(reader, writer):
+        cache.listeners.append(lambda touched: writer.write(_line({"bump": sorted(touched)})))
+        while line := await reader.readline():
+            message = json.loads(line)
+            if "update" in message:
+                chats.submit(shard_key(message["update"]), message["update"])
+            elif "bump" in message:
+                on_remote_bump(message["bump"])
+        # Intake closed the stream: finish what we have, then exit
+        await chats.drain()
+        writer.close()
+        done.set()
+
+    path = socket_path(index, socket_dir)
+    server = await asyncio.start_unix_server(handle, path, limit=LINE_LIMIT)
+    logger.info(f"Worker {index}/{workers} ready on {path}")
+    try:
+        await done.wait()
+    finally:
+        server.close()
+        await app.shutdown()
+        await app.bot.session.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--workers", type=int, default=CLUSTER_WORKERS)
+    ap.add_argument("--mode", choices=["polling", "webhook"], default=BOT_MODE)
+    ap.add_argument("--socket-dir", default=CLUSTER_SOCKET_DIR)
+    ap.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    setup_logging()
+    try:
+        if args.worker is None:
+            asyncio.run(run_intake(args.workers, args.mode, args.socket_dir))
+        else:
+            # Ctrl+C reaches the whole process group; workers stop when the intake closes their stream
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            asyncio.run(run_worker(args.worker, args.workers, args.socket_dir))
+    finally:
+        stop_logging()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,6 @@
 import os
-from dotenv import load_dotenv
-from cryptography.fernet import Fernet
+from dotenv import load_dotenv, set_key
+from cryptography.fernet import Fernet, MultiFernet
 
 load_dotenv()
 
@@ -11,16 +11,34 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_IDS = [int(i.strip()) for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip()]
 
 # Database URL
-DB_URL = "sqlite+aiosqlite:///gpt_admin.db"
+DB_URL = os.getenv("DB_URL", "sqlite+aiosqlite:///gpt_admin.db")
 
-# Encryption Key (Fernet)
-# If not provided in .env, generate one (but it should be stored in .env for production persistence)
+# Database tuning (SQLite pragmas are applied on every new connection)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30")) # seconds
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-64000")), # negative = KiB
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")), # ms
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+DB_EXPLAIN_ON_START = os.getenv("DB_EXPLAIN_ON_START", "0") == "1" # print query plans at startup
+
+# Encryption Keys (Fernet)
+# SECRET_KEY may hold several comma separated keys: the first one encrypts, all of them
+# decrypt (MultiFernet). To rotate, prepend a new key and run /rekey.
+# If not provided in .env, one is generated and written back so stored credentials survive restarts.
 SECRET_KEY = os.getenv("SECRET_KEY")
 if not SECRET_KEY:
     SECRET_KEY = Fernet.generate_key().decode()
-    # In a real scenario, you'd write this back to .env if missing
-    
-fernet = Fernet(SECRET_KEY.encode())
+    set_key(".env", "SECRET_KEY", SECRET_KEY)
+
+SECRET_KEYS = [k.strip() for k in SECRET_KEY.split(",") if k.strip()]
+primary_fernet = Fernet(SECRET_KEYS[0].encode())
+fernet = MultiFernet([Fernet(k.encode()) for k in SECRET_KEYS])
 
 def encrypt_data(data: str) -> str:
     if not data: return ""
@@ -30,5 +48,88 @@ def decrypt_data(encrypted_data: str) -> str:
     if not encrypted_data: return ""
     return fernet.decrypt(encrypted_data.encode()).decode()
 
+DECRYPT_CACHE_SIZE = int(os.getenv("DECRYPT_CACHE_SIZE", "1024")) # decrypted credentials kept in memory
+REKEY_BATCH_SIZE = int(os.getenv("REKEY_BATCH_SIZE", "200")) # rows re-encrypted per transaction
+
+# Member import pipeline
+IMPORT_CHUNK_LINES = int(os.getenv("IMPORT_CHUNK_LINES", "20000")) # lines per parser chunk
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "0")) or None # parser processes (default: CPU count)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000")) # rows per INSERT batch
+
+# Read-through cache for accounts/packages/member lookups
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300")) # seconds
+RENDER_SHOWN_SIZE = int(os.getenv("RENDER_SHOWN_SIZE", "5000")) # messages whose last render is remembered to skip no-op edits
+
+# Member/account search (SQLite FTS5 trigram index)
+SEARCH_RESULTS = int(os.getenv("SEARCH_RESULTS", "10")) # matches shown per search
+
+# CSV export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000")) # rows fetched/written per batch
+
+# FSM storage ("sqlite" persists conversations across restarts, "memory" does not)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1.0")) # seconds between write-behind flushes
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000")) # idle chats kept in memory
+
+# Expiry reminders: days before cycle_end at which admins are alerted
+REMINDER_DAYS = sorted({int(d) for d in os.getenv("REMINDER_DAYS", "7,3,1").split(",") if d.strip()}, reverse=True)
+
+# Expiry sweep: members past expiry_date and accounts past cycle_end are marked expired
+EXPIRY_SWEEP_MINUTES = int(os.getenv("EXPIRY_SWEEP_MINUTES", "10")) # how often the sweep runs
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "500")) # rows updated per statement/transaction
+
+# Outbound message dispatcher (Telegram allows ~30 msg/s overall and ~1 msg/s per chat)
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30")) # messages per second
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1")) # messages per second per chat
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "3"))
+
+# Payment review queue
+REVIEW_PAGE_SIZE = min(int(os.getenv("REVIEW_PAGE_SIZE", "10")), 10) # one media group holds at most 10 photos
+REVIEW_LOCK_MINUTES = int(os.getenv("REVIEW_LOCK_MINUTES", "15")) # how long a page stays reserved for one admin
+# Seat allocation on approval: "best_fit" fills the fullest workspace first, "first_expiring" the one ending soonest
+ALLOC_POLICY = os.getenv("ALLOC_POLICY", "best_fit").lower()
+ALLOC_MIN_DAYS = int(os.getenv("ALLOC_MIN_DAYS", "3")) # never place new members in a workspace ending sooner than this
+
+# Runtime mode: "polling" (getUpdates loop) or "webhook" (Telegram POSTs updates to our aiohttp server)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "") # custom/local Bot API server, empty = api.telegram.org
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "") # public https base, e.g. https://bot.example.com; empty = don't call setWebhook
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "") # checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HANDLING = os.getenv("WEBHOOK_HANDLING", "concurrent").lower() # "concurrent" or "sequential"
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30")) # seconds to finish in-flight updates on shutdown
+
+# Cluster mode (python cluster.py): one intake process shards updates by chat to N workers
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", "0")) or os.cpu_count() or 1
+CLUSTER_SOCKET_DIR = os.getenv("CLUSTER_SOCKET_DIR", "run") # UNIX sockets between intake and workers
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "30")) # getUpdates long-poll seconds (cluster intake)
+
+# Handler latency metrics
+SLOW_UPDATE_MS = int(os.getenv("SLOW_UPDATE_MS", "1000")) # updates slower than this are logged with their breakdown
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) # Prometheus text endpoint on /metrics, 0 = disabled
+
+# Logging (records are written by a background thread; see log_setup.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-module overrides, e.g. "aiogram.event=WARNING,cache=DEBUG"
+LOG_LEVELS = {
+    name.strip(): level.strip().upper()
+    for name, _, level in (item.partition("=") for item in os.getenv(
+        "LOG_LEVELS", "aiogram.event=WARNING,sqlalchemy.engine=WARNING,aiosqlite=WARNING,apscheduler=WARNING").split(","))
+    if name.strip() and level.strip()
+}
+LOG_FILE = os.getenv("LOG_FILE", "logs/bot.log")
+LOG_ROTATE = os.getenv("LOG_ROTATE", "size").lower() # "size" or "time" (daily at midnight)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "7")) # rotated files kept
+LOG_JSON = os.getenv("LOG_JSON", "0") == "1" # JSON lines instead of plain text
+LOG_DEBUG_SAMPLE = int(os.getenv("LOG_DEBUG_SAMPLE", "1")) # keep 1 in N DEBUG records per call site
+
 # UI Settings
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "20")) # buttons per account list page
+MEMBERS_PAGE_SIZE = int(os.getenv("MEMBERS_PAGE_SIZE", "30")) # members per list page
 TIMEZONE_OFFSET = 3.5 # For Iran (Optional if server local is enough)
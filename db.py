@@ -1,33 +1,114 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, Float, select, update, delete
+import asyncio
+import functools
+import logging
+from collections import Counter
+from cryptography.fernet import InvalidToken
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Boolean, Text, Float, Index, UniqueConstraint, event, func, inspect, select, update, delete, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from config import DB_URL
+from sqlalchemy.orm import Session, sessionmaker, declarative_base, relationship
+from sqlalchemy.types import TypeDecorator
+from config import (DB_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, SQLITE_PRAGMAS,
+                    DECRYPT_CACHE_SIZE, REKEY_BATCH_SIZE, encrypt_data, fernet, primary_fernet)
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# --- Encrypted credential columns ---
+@functools.lru_cache(maxsize=DECRYPT_CACHE_SIZE)
+def _decrypt(token):
+    try:
+        return fernet.decrypt(token.encode()).decode()
+    except InvalidToken:
+        # Value written before the column was encrypted; /rekey will encrypt it
+        return token
+
+class Secret:
+    """
+    Ciphertext loaded from an EncryptedString column. Nothing is decrypted until the
+    value is actually turned into text (str(), f-string, .value), and decrypted values
+    are kept in a bounded LRU, so list views and exports never pay the Fernet cost.
+    """
+    __slots__ = ("token",)
+
+    def __init__(self, token):
+        self.token = token
+
+    @property
+    def value(self):
+        return _decrypt(self.token)
+
+    def __str__(self):
+        return self.value
+
+    def __format__(self, spec):
+        return format(self.value, spec)
+
+    def __bool__(self):
+        return bool(self.token)
+
+    def __eq__(self, other):
+        return self.token == other.token if isinstance(other, Secret) else NotImplemented
+
+    def __hash__(self):
+        return hash(self.token)
+
+    def __repr__(self):
+        return "Secret('***')"
+
+class EncryptedString(TypeDecorator):
+    """String column stored Fernet-encrypted; plain str values are encrypted on write."""
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or value == "":
+            return value
+        if isinstance(value, Secret):
+            return value.token
+        return encrypt_data(value)
+
+    def process_result_value(self, value, dialect):
+        return Secret(value) if value else value
+
 class Account(Base):
     __tablename__ = 'accounts'
+    __table_args__ = (
+        Index('ix_accounts_cycle_end', 'cycle_end'),
+        Index('ix_accounts_status_cycle_end', 'status', 'cycle_end'), # expiry sweep
+    )
     id = Column(Integer, primary_key=True)
     service_name = Column(String, default="ChatGPT Business")
     account_label = Column(String)
     owner_email = Column(String, unique=True, index=True)
-    login_email = Column(String, nullable=True) # Actual GPT login
-    login_password = Column(String, nullable=True) # Actual GPT pass
+    login_email = Column(EncryptedString, nullable=True) # Actual GPT login
+    login_password = Column(EncryptedString, nullable=True) # Actual GPT pass
     billing_email = Column(String, nullable=True)
     activated_at = Column(DateTime, default=datetime.utcnow)
     cycle_start = Column(DateTime, nullable=True)
     cycle_end = Column(DateTime, nullable=True)
     seats_total = Column(Integer, default=0)
+    members_count = Column(Integer, default=0, server_default="0", nullable=False) # maintained with every member write
     status = Column(String, default="active") # active/expired
+    auto_expired_at = Column(DateTime, nullable=True) # set when the expiry sweep expired it; only those are reactivated
     notes = Column(Text, nullable=True)
     
     members = relationship("Member", back_populates="account", cascade="all, delete-orphan")
     invoices = relationship("Invoice", back_populates="account", cascade="all, delete-orphan")
     payments = relationship("Payment", back_populates="account")
 
+    @property
+    def free_seats(self):
+        return max((self.seats_total or 0) - (self.members_count or 0), 0)
+
 class Member(Base):
     __tablename__ = 'members'
+    __table_args__ = (
+        Index('ix_members_account_status', 'account_id', 'status'),
+        Index('ix_members_account_id', 'account_id', 'id'), # keyset pages of one account
+        Index('ix_members_status_expiry', 'status', 'expiry_date'), # expiry sweep
+    )
     id = Column(Integer, primary_key=True)
     account_id = Column(Integer, ForeignKey('accounts.id'), nullable=True)
     name = Column(String)
@@ -36,6 +117,7 @@ class Member(Base):
     status = Column(String, default="Active") # Active/Expired/Pending
     date_added = Column(DateTime, default=datetime.utcnow)
     expiry_date = Column(DateTime, nullable=True)
+    auto_expired_at = Column(DateTime, nullable=True) # set when the expiry sweep expired it; only those are reactivated
     telegram_id = Column(Integer, unique=True, index=True)
     phone = Column(String, nullable=True)
     active = Column(Boolean, default=True)
@@ -51,6 +133,9 @@ class Package(Base):
 
 class Payment(Base):
     __tablename__ = 'payments'
+    __table_args__ = (
+        Index('ix_payments_status_created', 'status', 'created_at'),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer) # Telegram ID
     account_id = Column(Integer, ForeignKey('accounts.id'), nullable=True)
@@ -59,6 +144,8 @@ class Payment(Base):
     receipt_photo_id = Column(String)
     status = Column(String, default="Pending") # Pending/Approved/Rejected
     created_at = Column(DateTime, default=datetime.utcnow)
+    review_by = Column(Integer, nullable=True) # admin currently reviewing (lock holder)
+    review_until = Column(DateTime, nullable=True) # lock lease expiry
 
     account = relationship("Account", back_populates="payments")
 
@@ -78,9 +165,305 @@ class Invoice(Base):
 
     account = relationship("Account", back_populates="invoices")
 
-engine = create_async_engine(DB_URL)
+class ReminderLog(Base):
+    __tablename__ = 'reminder_log'
+    __table_args__ = (
+        UniqueConstraint('account_id', 'threshold_days', 'cycle_end', name='uq_reminder_once'),
+    )
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey('accounts.id', ondelete="CASCADE"))
+    threshold_days = Column(Integer) # 7/3/1
+    cycle_end = Column(DateTime) # the cycle the reminder belongs to
+    sent_at = Column(DateTime, default=datetime.utcnow)
+
+class StatsColumns:
+    # Gauges (snapshot of current state)
+    accounts_active = Column(Integer, default=0, server_default="0")
+    seats_total = Column(Integer, default=0, server_default="0")
+    seats_used = Column(Integer, default=0, server_default="0")
+    payments_pending = Column(Integer, default=0, server_default="0")
+    # Flows (incremented per event)
+    payments_created = Column(Integer, default=0, server_default="0")
+    payments_approved = Column(Integer, default=0, server_default="0")
+    invoices_count = Column(Integer, default=0, server_default="0")
+    revenue_billed = Column(Float, default=0, server_default="0") # sum of Invoice.total_due
+    revenue_paid = Column(Float, default=0, server_default="0") # sum of Invoice.paid_amount
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class DailyStats(StatsColumns, Base):
+    __tablename__ = 'stats_daily'
+    day = Column(Date, primary_key=True)
+
+class MonthlyStats(StatsColumns, Base):
+    __tablename__ = 'stats_monthly'
+    month = Column(String, primary_key=True) # YYYY-MM
+
+class FsmState(Base):
+    __tablename__ = 'fsm_states'
+    key = Column(String, primary_key=True) # bot:chat:user:thread:business:destiny
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=True) # JSON
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+def make_engine(url=DB_URL, **kwargs):
+    """
+    Creates the async engine with the bot's tuning applied.
+    For SQLite every new connection gets SQLITE_PRAGMAS (WAL, synchronous=NORMAL,
+    mmap/cache size, busy_timeout); file databases also get a bounded pool.
+    """
+    if url.startswith("sqlite") and ":memory:" not in url:
+        kwargs.setdefault("pool_size", DB_POOL_SIZE)
+        kwargs.setdefault("max_overflow", DB_MAX_OVERFLOW)
+        kwargs.setdefault("pool_timeout", DB_POOL_TIMEOUT)
+    new_engine = create_async_engine(url, **kwargs)
+
+    if new_engine.dialect.name == "sqlite":
+        @event.listens_for(new_engine.sync_engine, "connect")
+        def set_sqlite_pragmas(dbapi_conn, _):
+            cursor = dbapi_conn.cursor()
+            for name, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    return new_engine
+
+engine = make_engine()
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# --- Seat counters ---
+# Account.members_count is kept in step with the members table inside the same
+# transaction: bulk Core writes call adjust_members_count(), ORM adds/deletes/moves
+# of Member objects are picked up by the flush hook below.
+
+async def adjust_members_count(session, deltas):
+    """Applies {account_id: delta} to Account.members_count in the session's transaction."""
+    for acc_id, delta in deltas.items():
+        if acc_id is not None and delta:
+            await session.execute(
+                update(Account.__table__)
+                .where(Account.__table__.c.id == acc_id)
+                .values(members_count=Account.__table__.c.members_count + delta)
+            )
+
+def recount_members_stmt():
+    # Repairs every counter from the members table (used after schema upgrades)
+    return update(Account.__table__).values(
+        members_count=select(func.count(Member.id))
+        .where(Member.account_id == Account.__table__.c.id)
+        .scalar_subquery()
+    )
+
+@event.listens_for(Session, "after_flush")
+def _track_member_counts(session, flush_context):
+    deltas = Counter()
+    for obj in session.new:
+        if isinstance(obj, Member):
+            deltas[obj.account_id] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Member):
+            history = inspect(obj).attrs.account_id.history
+            deltas[history.deleted[0] if history.deleted else obj.account_id] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Member):
+            history = inspect(obj).attrs.account_id.history
+            if history.has_changes():
+                for old_id in history.deleted:
+                    deltas[old_id] -= 1
+                for new_id in history.added:
+                    deltas[new_id] += 1
+    table = Account.__table__
+    for acc_id, delta in deltas.items():
+        if acc_id is not None and delta:
+            session.connection().execute(
+                update(table).where(table.c.id == acc_id).values(members_count=table.c.members_count + delta)
+            )
+
+def _add_missing_columns(conn):
+    """Adds model columns missing from existing tables (create_all never alters). Returns them."""
+    inspector = inspect(conn)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            conn.execute(text(ddl))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+def _create_indexes(conn):
+    # create_all() only builds indexes together with new tables; add missing ones to old databases
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+# --- Full-text search index ---
+# One FTS5 (trigram) document per member and per account, kept in sync by triggers.
+# rowid encodes the source row so trigger updates/deletes are rowid lookups:
+# members -> id * 2, accounts -> id * 2 + 1. Accounts store label/owner_email in name/email.
+SEARCH_TABLE = "search_index"
+SEARCH_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(name, email, telegram_id, tokenize='trigram')",
+    f"""CREATE TRIGGER IF NOT EXISTS members_search_ins AFTER INSERT ON members BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, name, email, telegram_id) VALUES (new.id * 2, new.name, new.email, new.telegram_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS members_search_upd AFTER UPDATE OF name, email, telegram_id ON members BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2;
+        INSERT INTO {SEARCH_TABLE}(rowid, name, email, telegram_id) VALUES (new.id * 2, new.name, new.email, new.telegram_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS members_search_del AFTER DELETE ON members BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS accounts_search_ins AFTER INSERT ON accounts BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, name, email) VALUES (new.id * 2 + 1, new.account_label, new.owner_email);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS accounts_search_upd AFTER UPDATE OF account_label, owner_email ON accounts BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2 + 1;
+        INSERT INTO {SEARCH_TABLE}(rowid, name, email) VALUES (new.id * 2 + 1, new.account_label, new.owner_email);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS accounts_search_del AFTER DELETE ON accounts BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2 + 1;
+    END""",
+]
+SEARCH_BACKFILL = [
+    f"INSERT INTO {SEARCH_TABLE}(rowid, name, email, telegram_id) SELECT id * 2, name, email, telegram_id FROM members",
+    f"INSERT INTO {SEARCH_TABLE}(rowid, name, email) SELECT id * 2 + 1, account_label, owner_email FROM accounts",
+]
+
+def _create_search_index(conn):
+    """Creates the FTS table and its triggers; fills it once for databases that predate it."""
+    if conn.dialect.name != "sqlite":
+        return False
+    existed = inspect(conn).has_table(SEARCH_TABLE)
+    for ddl in SEARCH_DDL:
+        conn.execute(text(ddl))
+    if not existed:
+        for stmt in SEARCH_BACKFILL:
+            conn.execute(text(stmt))
+    return not existed
+
+# --- Schema version ---
+# Stored in SQLite's `PRAGMA user_version` once init_db has brought a database up to
+# date, so later starts skip create_all/reflection entirely. Bump it whenever a model,
+# an index or the search DDL changes.
+SCHEMA_VERSION = 3
+
+async def _schema_current(conn):
+    if conn.dialect.name != "sqlite":
+        return False
+    return (await conn.execute(text("PRAGMA user_version"))).scalar() == SCHEMA_VERSION
+
 async def init_db():
+    """Creates/upgrades the schema; returns False when the stored version was already current."""
     async with engine.begin() as conn:
+        if await _schema_current(conn):
+            return False
         await conn.run_sync(Base.metadata.create_all)
+        added = await conn.run_sync(_add_missing_columns)
+        if added:
+            logger.info(f"Schema upgraded, added columns: {', '.join(added)}")
+        if "accounts.members_count" in added:
+            await conn.execute(recount_members_stmt())
+        await conn.run_sync(_create_indexes)
+        if await conn.run_sync(_create_search_index):
+            logger.info("Search index built")
+        if conn.dialect.name == "sqlite":
+            await conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+    return True
+
+async def fetch_page(session, stmt, id_col, size, after=None, before=None):
+    """
+    Keyset (id cursor) pagination: one bounded query per page, no OFFSET.
+    Pass `after` for the page following an id or `before` for the one preceding it.
+    Returns (rows, has_prev, has_next).
+    """
+    if before is not None:
+        rows = (await session.execute(stmt.where(id_col < before).order_by(id_col.desc()).limit(size + 1))).scalars().all()
+        has_prev = len(rows) > size
+        return list(reversed(rows[:size])), has_prev, True
+    if after is not None:
+        stmt = stmt.where(id_col > after)
+    rows = (await session.execute(stmt.order_by(id_col).limit(size + 1))).scalars().all()
+    return rows[:size], bool(after), len(rows) > size
+
+# --- Key rotation ---
+ENCRYPTED_COLUMNS = (Account.login_email, Account.login_password)
+
+def _rekey_rows(rows):
+    updates = []
+    for row in rows:
+        changes = {}
+        for column in ENCRYPTED_COLUMNS:
+            secret = getattr(row, column.key)
+            if not secret:
+                continue
+            token = secret.token
+            try:
+                primary_fernet.decrypt(token.encode())
+                continue  # already under the current key
+            except InvalidToken:
+                pass
+            try:
+                changes[column.key] = Secret(fernet.rotate(token.encode()).decode())
+            except InvalidToken:
+                if token.startswith("gAAAAA"):
+                    logger.warning(f"Account {row.id}: {column.key} was encrypted with an unknown key, left as is")
+                    continue
+                changes[column.key] = Secret(encrypt_data(token))
+        if changes:
+            updates.append({"id": row.id, **changes})
+    return updates
+
+async def reencrypt_credentials(batch_size=REKEY_BATCH_SIZE):
+    """
+    Background job for key rotation: walks accounts in id batches and re-encrypts every
+    credential not already under the primary key (plaintext leftovers included).
+    Each batch is its own short transaction; Fernet work runs on a worker thread.
+    """
+    last_id, changed = 0, 0
+    while True:
+        async with async_session() as session:
+            rows = (await session.execute(
+                select(Account.id, *ENCRYPTED_COLUMNS).where(Account.id > last_id).order_by(Account.id).limit(batch_size)
+            )).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            updates = await asyncio.to_thread(_rekey_rows, rows)
+            if updates:
+                await session.execute(update(Account), updates)
+                await session.commit()
+                changed += len(updates)
+        await asyncio.sleep(0)
+    if changed:
+        logger.info(f"Re-encrypted credentials of {changed} accounts")
+    return changed
+
+# Queries the bot runs on every menu tap; used to confirm the indexes are picked up
+HOT_QUERIES = {
+    "members of account": select(Member).where(Member.account_id == 1),
+    "active members of account": select(Member).where(Member.account_id == 1, Member.status == "Active"),
+    "members page": select(Member).where(Member.account_id == 1, Member.id > 100).order_by(Member.id).limit(31),
+    "member by telegram id": select(Member).where(Member.telegram_id == 1),
+    "pending payments": select(Payment).where(Payment.status == "Pending").order_by(Payment.created_at),
+    "accounts by expiry": select(Account).order_by(Account.cycle_end),
+    "expired members": select(Member.id).where(Member.status == "Active", Member.expiry_date <= datetime(2000, 1, 1)).limit(500),
+    "expired accounts": select(Account.id).where(Account.status == "active", Account.cycle_end <= datetime(2000, 1, 1)).limit(500),
+}
+
+async def explain_hot_queries():
+    """Prints EXPLAIN QUERY PLAN for HOT_QUERIES and returns {name: [plan lines]}."""
+    plans = {}
+    async with engine.connect() as conn:
+        for name, stmt in HOT_QUERIES.items():
+            sql = str(stmt.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            rows = (await conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))).all()
+            plans[name] = [row[-1] for row in rows]
+    for name, lines in plans.items():
+        print(f"[query plan] {name}: " + " | ".join(lines))
+    return plans
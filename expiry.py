@@ -0,0 +1,108 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+from config import EXPIRY_BATCH_SIZE
+from db import async_session, Account, Member
+
+logger = logging.getLogger(__name__)
+
+_members = Member.__table__
+_accounts = Account.__table__
+
+
+async def _drain(table, ids_stmt, values, returning, batch_size):
+    """
+    Repeats one set-based UPDATE over at most `batch_size` ids (picked by an indexed
+    range scan) in its own short transaction until it stops matching rows.
+    """
+    stmt = (
+        update(table)
+        .where(table.c.id.in_(ids_stmt.limit(batch_size).scalar_subquery()))
+        .values(**values)
+        .returning(*returning)
+    )
+    rows = []
+    while True:
+        async with async_session() as session:
+            async with session.begin():
+                batch = (await session.execute(stmt)).all()
+        rows += batch
+        if len(batch) < batch_size:
+            return rows
+
+
+async def sweep(now=None, batch_size=EXPIRY_BATCH_SIZE):
+    """
+    Brings member and account status in line with expiry_date / cycle_end.
+
+    Accounts past cycle_end become "expired"; members past expiry_date, and members
+    without an expiry_date of their own in any expired account, become "Expired"
+    and inactive; both get auto_expired_at. Rows the sweep expired whose date was
+    pushed into the future (or whose account is active again) are switched back;
+    manual "expired" statuses are kept.
+    Every step is an UPDATE ... RETURNING over the (status, date) indexes in
+    batches of `batch_size`, one short transaction each; nothing is loaded besides
+    the returned ids. Returns {"members": [telegram_id, ...] newly expired,
+    "accounts": [(id, label), ...] newly expired, "reactivated": count}.
+    """
+    now = now or datetime.utcnow()
+    result = {"members": [], "accounts": [], "reactivated": 0}
+
+    expired_accounts = await _drain(
+        _accounts,
+        select(_accounts.c.id).where(_accounts.c.status == "active", _accounts.c.cycle_end <= now),
+        {"status": "expired", "auto_expired_at": now}, (_accounts.c.id, _accounts.c.account_label), batch_size,
+    )
+    result["accounts"] = [(row.id, row.account_label) for row in expired_accounts]
+
+    # Members without their own expiry_date follow their account: any expired account,
+    # so members added to one later (e.g. by a re-sync) are caught by the next sweep
+    rows = await _drain(
+        _members,
+        select(_members.c.id).where(
+            _members.c.account_id.in_(select(_accounts.c.id).where(_accounts.c.status == "expired")),
+            _members.c.status == "Active", _members.c.expiry_date.is_(None),
+        ),
+        {"status": "Expired", "active": False, "auto_expired_at": now}, (_members.c.telegram_id,), batch_size,
+    )
+    result["members"] += [row.telegram_id for row in rows]
+
+    rows = await _drain(
+        _members,
+        select(_members.c.id).where(_members.c.status == "Active", _members.c.expiry_date <= now),
+        {"status": "Expired", "active": False, "auto_expired_at": now}, (_members.c.telegram_id,), batch_size,
+    )
+    result["members"] += [row.telegram_id for row in rows]
+    result["members"] = [tg for tg in result["members"] if tg is not None]
+
+    # Rows this sweep expired whose date was pushed forward since (renewals) go back to
+    # active; anything an admin marked expired by hand has no auto_expired_at and stays
+    reactivated = await _drain(
+        _accounts,
+        select(_accounts.c.id).where(_accounts.c.status == "expired", _accounts.c.cycle_end > now,
+                                     _accounts.c.auto_expired_at.is_not(None)),
+        {"status": "active", "auto_expired_at": None}, (_accounts.c.id,), batch_size,
+    )
+    result["reactivated"] += len(reactivated)
+    # ... and so do their members, also when an admin set the account active again
+    result["reactivated"] += len(await _drain(
+        _members,
+        select(_members.c.id).where(
+            _members.c.account_id.in_(select(_accounts.c.id).where(_accounts.c.status == "active")),
+            _members.c.status == "Expired", _members.c.expiry_date.is_(None), _members.c.auto_expired_at.is_not(None),
+        ),
+        {"status": "Active", "active": True, "auto_expired_at": None}, (_members.c.id,), batch_size,
+    ))
+    result["reactivated"] += len(await _drain(
+        _members,
+        select(_members.c.id).where(_members.c.status == "Expired", _members.c.expiry_date > now,
+                                    _members.c.auto_expired_at.is_not(None)),
+        {"status": "Active", "active": True, "auto_expired_at": None}, (_members.c.id,), batch_size,
+    ))
+
+    if result["members"] or result["accounts"] or result["reactivated"]:
+        logger.info(f"Expiry sweep: {len(result['accounts'])} accounts and {len(result['members'])} members expired, "
+                    f"{result['reactivated']} reactivated")
+    return result
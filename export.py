@@ -0,0 +1,131 @@
+import asyncio
+import csv
+import gzip
+import io
+import logging
+import os
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+
+from aiogram.types import FSInputFile
+from sqlalchemy import select
+
+import cache
+from config import EXPORT_BATCH_SIZE
+from db import engine, Account, Member
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"csv": ".csv", "gz": ".csv.gz", "zip": ".zip"}
+HEADER = ['Account', 'Member Name', 'Email', 'Role', 'Status', 'Date Added']
+
+# (fmt, account_id, date_from, date_to) -> (data stamp, Telegram file_id)
+_sent_files = {}
+
+
+def export_query(account_id=None, date_from=None, date_to=None):
+    """One joined query, so no per-member account lookups are needed."""
+    stmt = (
+        select(Account.account_label, Member.name, Member.email, Member.role, Member.status, Member.date_added)
+        .select_from(Member)
+        .outerjoin(Account, Member.account_id == Account.id)
+        .order_by(Member.id)
+    )
+    if account_id is not None:
+        stmt = stmt.where(Member.account_id == account_id)
+    if date_from is not None:
+        stmt = stmt.where(Member.date_added >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Member.date_added < date_to + timedelta(days=1))
+    return stmt
+
+
+def _open_writer(path, fmt):
+    if fmt == "gz":
+        stream = gzip.open(path, "wt", encoding="utf-8-sig", newline="")
+        return stream, stream
+    if fmt == "zip":
+        archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        inner = archive.open("export.csv", "w", force_zip64=True)
+        stream = io.TextIOWrapper(inner, encoding="utf-8-sig", newline="")
+        return stream, _ZipCloser(stream, archive)
+    stream = open(path, "w", newline="", encoding="utf-8-sig")
+    return stream, stream
+
+
+class _ZipCloser:
+    def __init__(self, stream, archive):
+        self.stream, self.archive = stream, archive
+
+    def close(self):
+        self.stream.close()
+        self.archive.close()
+
+
+def _write_rows(writer, rows):
+    writer.writerows(
+        [label or 'N/A', name, email, role, status, date_added.strftime('%Y-%m-%d') if date_added else '']
+        for label, name, email, role, status, date_added in rows
+    )
+
+
+async def write_export(fmt="csv", account_id=None, date_from=None, date_to=None):
+    """
+    Streams the joined members export into a temp file and returns (path, row count).
+    Rows come from a server-side cursor in batches; formatting, compression and disk
+    writes happen on a worker thread, so memory stays flat and the loop stays free.
+    """
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=FORMATS[fmt])
+    os.close(fd)
+    stream, closer = await asyncio.to_thread(_open_writer, path, fmt)
+    writer = csv.writer(stream)
+    total = 0
+    try:
+        await asyncio.to_thread(writer.writerow, HEADER)
+        async with engine.connect() as conn:
+            result = await conn.stream(
+                export_query(account_id, date_from, date_to).execution_options(yield_per=EXPORT_BATCH_SIZE)
+            )
+            async for rows in result.partitions(EXPORT_BATCH_SIZE):
+                await asyncio.to_thread(_write_rows, writer, rows)
+                total += len(rows)
+    except BaseException:
+        await asyncio.to_thread(closer.close)
+        os.remove(path)
+        raise
+    await asyncio.to_thread(closer.close)
+    return path, total
+
+
+def _stamp():
+    return cache.version("members"), cache.version("accounts")
+
+
+def cached_file_id(key):
+    """Telegram file_id of the last identical export, if no member/account changed since."""
+    entry = _sent_files.get(key)
+    if entry and entry[0] == _stamp():
+        return entry[1]
+    return None
+
+
+async def send_export(message, fmt="csv", account_id=None, date_from=None, date_to=None):
+    """Sends the export as a document, re-using the uploaded file while the data is unchanged."""
+    key = (fmt, account_id, date_from, date_to)
+    file_id = cached_file_id(key)
+    caption = "📊 خروجی CSV"
+    if file_id:
+        logger.info(f"Re-using uploaded export {key}")
+        await message.answer_document(file_id, caption=caption)
+        return
+
+    stamp = _stamp()
+    path, total = await write_export(fmt, account_id, date_from, date_to)
+    try:
+        filename = f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}{FORMATS[fmt]}"
+        sent = await message.answer_document(FSInputFile(path, filename=filename), caption=f"{caption} ({total} ردیف)")
+    finally:
+        os.remove(path)
+    _sent_files[key] = (stamp, sent.document.file_id)
+    logger.info(f"Exported {total} members {key}")
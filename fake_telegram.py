@@ -0,0 +1,109 @@
+"""
+In-process stand-in for the Telegram Bot API, used by the benchmarks.
+
+Answers every method with a minimal valid result, serves pushed updates through
+getUpdates and timestamps the first reply to each chat, so end-to-end latency can
+be measured without talking to Telegram.
+"""
+import asyncio
+import time
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    """Answers Bot API calls, serves getUpdates and timestamps every reply per chat."""
+
+    def __init__(self):
+        self.pending = []
+        self.new_updates = asyncio.Event()
+        self.polled = asyncio.Event()  # set once a client has called getUpdates
+        self.sent_at = {}
+        self.done_at = {}
+        self.replies = {}  # chat_id -> methods of the bot's replies, in arrival order
+        self.all_done = asyncio.Event()
+        self.expected = 0
+        self.per_chat = 1
+
+    def reset(self, expected, per_chat=1):
+        """Waits for `expected` chats to each receive `per_chat` replies."""
+        self.pending.clear()
+        self.sent_at.clear()
+        self.done_at.clear()
+        self.replies.clear()
+        self.all_done.clear()
+        self.expected = expected
+        self.per_chat = per_chat
+
+    def push(self, updates):
+        now = time.perf_counter()
+        for update in updates:
+            self.sent_at.setdefault(chat_of(update), now)
+        self.pending.extend(updates)
+        self.new_updates.set()
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        form = await request.json() if request.content_type == "application/json" else await request.post()
+        if method == "getMe":
+            return self._ok({"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"})
+        if method == "getUpdates":
+            self.polled.set()
+            return self._ok(await self._get_updates(form))
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(form["chat_id"])
+            replies = self.replies.setdefault(chat_id, [])
+            replies.append(method)
+            if chat_id in self.sent_at and len(replies) == self.per_chat:
+                self.done_at[chat_id] = time.perf_counter()
+                if len(self.done_at) >= self.expected:
+                    self.all_done.set()
+            return self._ok({"message_id": 1, "date": int(time.time()),
+                             "chat": {"id": chat_id, "type": "private"}, "text": form.get("text", "")})
+        return self._ok(True)
+
+    async def _get_updates(self, form):
+        offset = int(form.get("offset") or 0)
+        self.pending = [u for u in self.pending if u["update_id"] >= offset]
+        if not self.pending:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), float(form.get("timeout") or 0) or 0.1)
+            except asyncio.TimeoutError:
+                pass
+        return self.pending[:100]
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({"ok": True, "result": result})
+
+    async def serve(self, host, port):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def chat_of(update):
+    event = update.get("message") or update["callback_query"]["message"]
+    return event["chat"]["id"]
+
+
+def make_updates(count, first_id):
+    updates = []
+    for i in range(first_id, first_id + count):
+        chat_id = 10_000_000 + i
+        updates.append({
+            "update_id": i,
+            "message": {
+                "message_id": i,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+                "text": "/start",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            },
+        })
+    return updates
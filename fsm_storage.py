@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from config import FSM_STORAGE, FSM_FLUSH_INTERVAL, FSM_CACHE_SIZE
+from db import engine as default_engine, FsmState
+
+logger = logging.getLogger(__name__)
+
+
+def _encode(obj):
+    # FSM data carries datetimes (e.g. AddAccountState.activated_at)
+    if isinstance(obj, datetime):
+        return {"__dt__": obj.isoformat()}
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def _decode(obj):
+    if len(obj) == 1 and "__dt__" in obj:
+        return datetime.fromisoformat(obj["__dt__"])
+    return obj
+
+
+def dump_data(data):
+    return json.dumps(data, default=_encode, ensure_ascii=False)
+
+
+def load_data(raw):
+    return json.loads(raw, object_hook=_decode) if raw else {}
+
+
+def storage_key_id(key):
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.business_connection_id}:{key.destiny}"
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage on the bot's SQLite database.
+
+    Reads are served from an in-memory hot layer (an LRU of loaded chats), so an active
+    conversation costs the same as MemoryStorage. Writes only mark the chat dirty; a
+    background task flushes all dirty chats every `flush_interval` seconds in one
+    transaction, so a crash loses at most one interval of state changes.
+    """
+
+    def __init__(self, engine=default_engine, flush_interval=FSM_FLUSH_INTERVAL, cache_size=FSM_CACHE_SIZE):
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self._records = OrderedDict()  # key id -> [state, data]
+        self._dirty = set()
+        self._lock = asyncio.Lock()
+        self._flusher = None
+
+    async def _record(self, key):
+        key_id = storage_key_id(key)
+        record = self._records.get(key_id)
+        if record is None:
+            async with self.engine.connect() as conn:
+                row = (await conn.execute(
+                    select(FsmState.state, FsmState.data).where(FsmState.key == key_id)
+                )).first()
+            # Another coroutine may have loaded or written the chat while we awaited
+            record = self._records.get(key_id)
+            if record is None:
+                record = [row.state, load_data(row.data)] if row else [None, {}]
+                self._records[key_id] = record
+        self._records.move_to_end(key_id)
+        self._evict()
+        return key_id, record
+
+    def _evict(self):
+        # Only clean chats can be dropped; they reload from the database on demand
+        while len(self._records) > self.cache_size:
+            for key_id in self._records:
+                if key_id not in self._dirty:
+                    del self._records[key_id]
+                    break
+            else:
+                break
+
+    def _mark(self, key_id):
+        self._dirty.add(key_id)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, key, state=None):
+        key_id, record = await self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._mark(key_id)
+
+    async def get_state(self, key):
+        return (await self._record(key))[1][0]
+
+    async def set_data(self, key, data):
+        key_id, record = await self._record(key)
+        record[1] = dict(data)
+        self._mark(key_id)
+
+    async def get_data(self, key):
+        return (await self._record(key))[1][1].copy()
+
+    async def _flush_loop(self):
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"FSM flush failed, will retry: {e}")
+
+    async def flush(self):
+        """Writes every dirty chat in one transaction (upserts, deletes for cleared chats)."""
+        async with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            now = datetime.utcnow()
+            upserts, cleared = [], []
+            for key_id in dirty:
+                state, data = self._records.get(key_id, (None, {}))
+                if state is None and not data:
+                    cleared.append(key_id)
+                    continue
+                try:
+                    upserts.append({"key": key_id, "state": state, "data": dump_data(data), "updated_at": now})
+                except Exception as e:
+                    # Only this chat is skipped (it is written again once its data changes)
+                    logger.error(f"FSM data of {key_id} is not serializable, not saved: {e}")
+            try:
+                async with self.engine.begin() as conn:
+                    if upserts:
+                        stmt = sqlite_insert(FsmState.__table__)
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=["key"],
+                            set_={"state": stmt.excluded.state, "data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at},
+                        )
+                        await conn.execute(stmt, upserts)
+                    if cleared:
+                        await conn.execute(delete(FsmState).where(FsmState.key.in_(cleared)))
+            except BaseException:
+                # Also on cancellation (close() during a flush): the final flush writes them
+                self._dirty |= dirty
+                raise
+            logger.debug(f"FSM flush: {len(upserts)} saved, {len(cleared)} cleared")
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
+
+
+def make_storage():
+    """Storage selected by FSM_STORAGE."""
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    return SQLiteStorage()
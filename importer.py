@@ -0,0 +1,217 @@
+import asyncio
+import csv
+import html
+import logging
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import select, insert, update, delete
+
+from config import IMPORT_CHUNK_LINES, IMPORT_WORKERS, IMPORT_BATCH_SIZE
+from db import async_session, adjust_members_count, Account, Member
+from parser import iter_members, iter_csv_members, csv_header_columns, EMAIL_RE, DATE_RE, HEADER_RE, ROLES
+
+logger = logging.getLogger(__name__)
+
+TEXT, CSV, HTML = "text", "csv", "html"
+UPLOAD_KINDS = {".txt": TEXT, ".csv": CSV, ".html": HTML, ".htm": HTML}
+
+_TAG_RE = re.compile(r'<(script|style)\b.*?</\1\s*>|<[^>]+>', re.S | re.I)
+
+_pool = None
+
+
+def detect_kind(filename):
+    """Maps an uploaded file name to an input kind, or None if unsupported."""
+    return UPLOAD_KINDS.get(os.path.splitext(filename or "")[1].lower())
+
+
+def html_to_lines(text):
+    # Every tag becomes a line break, which is how the members table renders when pasted
+    return html.unescape(_TAG_RE.sub("\n", text)).split("\n")
+
+
+def _is_name_line(line):
+    return bool(line) and "@" not in line and line not in ROLES \
+        and not DATE_RE.search(line) and not HEADER_RE.search(line)
+
+
+def split_chunks(lines, chunk_lines=IMPORT_CHUNK_LINES):
+    """
+    Splits page lines into chunks of about `chunk_lines` that parse independently.
+    A cut is only made right before the name line that precedes an email, so no
+    member's name/role/date ever straddles two chunks.
+    """
+    chunks = []
+    start = 0
+    last = None  # index of the last non-empty line
+    for i, raw in enumerate(lines):
+        line = raw.strip()
+        if not line:
+            continue
+        if (i - start >= chunk_lines and last is not None and last > start
+                and "@" in line and EMAIL_RE.search(line) and _is_name_line(lines[last].strip())):
+            chunks.append(lines[start:last])
+            start = last
+        last = i
+    chunks.append(lines[start:])
+    return chunks
+
+
+def split_csv(lines, chunk_lines=IMPORT_CHUNK_LINES):
+    # With a header row, every chunk carries it so columns resolve the same way;
+    # headerless files are split as they are (each row is scanned on its own)
+    if not lines:
+        return [lines]
+    if csv_header_columns(next(csv.reader(lines[:1]), [])):
+        header, rows = lines[0], lines[1:]
+        return [[header] + rows[i:i + chunk_lines] for i in range(0, len(rows), chunk_lines)] or [[header]]
+    return [lines[i:i + chunk_lines] for i in range(0, len(lines), chunk_lines)]
+
+
+def split_input(raw, kind=TEXT):
+    """Decodes an upload/paste and cuts it into parser chunks. CPU bound, run off the loop."""
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8-sig", errors="replace")
+    if kind == CSV:
+        return split_csv(raw.splitlines())
+    lines = html_to_lines(raw) if kind == HTML else raw.split("\n")
+    return split_chunks(lines)
+
+
+def parse_chunk(kind, lines):
+    """Process-pool entry point: parses one chunk into member dicts."""
+    if kind == CSV:
+        return list(iter_csv_members(lines))
+    return list(iter_members(lines))
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        from concurrent.futures import ProcessPoolExecutor  # multiprocessing is only loaded for the first import
+        _pool = ProcessPoolExecutor(max_workers=IMPORT_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def iter_parsed(raw, kind=TEXT):
+    """
+    Async generator of parsed member batches, in input order.
+    Small inputs are parsed on a thread; multi-chunk inputs fan out to the process pool.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = await loop.run_in_executor(None, split_input, raw, kind)
+    if len(chunks) == 1:
+        yield await loop.run_in_executor(None, parse_chunk, kind, chunks[0])
+        return
+    pool = get_pool()
+    futures = [loop.run_in_executor(pool, parse_chunk, kind, chunk) for chunk in chunks]
+    for fut in futures:
+        yield await fut
+
+
+def member_row(acc_id, m_data):
+    return {
+        "account_id": acc_id,
+        "name": m_data.get('name', 'Unknown'),
+        "email": m_data.get('email'),
+        "role": m_data.get('role', 'Member'),
+        "date_added": m_data.get('date_added') or datetime.utcnow(),
+        "status": "Active",
+    }
+
+
+async def sync_members(acc_id, raw, kind=TEXT):
+    """
+    Makes an account's member list match a paste/upload by applying only the delta.
+
+    The existing (email -> row) map is loaded once, added / removed / role-changed
+    sets are computed in memory and written with bulk INSERT, UPDATE and DELETE
+    statements in one transaction. Duplicate rows left over from append-only
+    imports are removed as well. Members without an email (placed by the seat
+    allocator, known only by telegram_id) are left alone and counted separately.
+    Returns the diff for reporting.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+
+    incoming = {}
+    async for parsed in iter_parsed(raw, kind):
+        for m_data in parsed:
+            incoming.setdefault(m_data['email'].lower(), m_data)
+    if not incoming:
+        raise ValueError("هیچ عضوی در متن پیدا نشد")
+
+    diff = {"added": [], "removed": [], "role_changed": [], "revived": [], "unchanged": 0, "no_email": 0}
+    async with async_session() as session:
+        async with session.begin():
+            account_active = (await session.execute(
+                select(Account.status).where(Account.id == acc_id)
+            )).scalar() == "active"
+            existing = {}
+            duplicate_ids = []
+            rows = await session.execute(
+                select(Member.id, Member.email, Member.role, Member.status, Member.expiry_date, Member.auto_expired_at)
+                .where(Member.account_id == acc_id)
+                .order_by(Member.id)
+            )
+            for row in rows:
+                if not row.email:
+                    diff["no_email"] += 1
+                    continue  # telegram-only members (seat allocation) are not on the workspace page yet
+                key = row.email.lower()
+                if key in existing:
+                    duplicate_ids.append(row.id)
+                else:
+                    existing[key] = row
+
+            now = datetime.utcnow()
+            to_insert = []
+            to_update = []
+            for key, m_data in incoming.items():
+                row = existing.get(key)
+                # Expiry is decided by the sweep and renewals only: rows it expired, rows whose paid
+                # period ran out and members of an account that is not active are never revived here
+                revive = (row is not None and row.status != "Active" and account_active
+                          and row.auto_expired_at is None and not (row.expiry_date and row.expiry_date <= now))
+                if row is None:
+                    to_insert.append(member_row(acc_id, m_data))
+                    diff["added"].append(m_data['email'])
+                elif row.role != m_data['role'] or revive:
+                    changes = {"id": row.id, "role": m_data['role']}
+                    if revive:
+                        changes.update(status="Active", active=True)
+                        diff["revived"].append(m_data['email'])
+                    to_update.append(changes)
+                    if row.role != m_data['role']:
+                        diff["role_changed"].append((m_data['email'], row.role, m_data['role']))
+                else:
+                    diff["unchanged"] += 1
+
+            to_delete = list(duplicate_ids)
+            for key, row in existing.items():
+                if key not in incoming:
+                    to_delete.append(row.id)
+                    diff["removed"].append(row.email)
+
+            for i in range(0, len(to_insert), IMPORT_BATCH_SIZE):
+                await session.execute(insert(Member), to_insert[i:i + IMPORT_BATCH_SIZE])
+            if to_update:
+                await session.execute(update(Member), to_update)
+            for i in range(0, len(to_delete), IMPORT_BATCH_SIZE):
+                await session.execute(delete(Member).where(Member.id.in_(to_delete[i:i + IMPORT_BATCH_SIZE])))
+            await adjust_members_count(session, {acc_id: len(to_insert) - len(to_delete)})
+
+    logger.info(
+        f"Synced account {acc_id}: +{len(diff['added'])} -{len(diff['removed'])} "
+        f"~{len(diff['role_changed'])} revived {len(diff['revived'])} ({len(duplicate_ids)} duplicates dropped) in {loop.time() - started:.2f}s"
+    )
+    return diff
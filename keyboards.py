@@ -1,6 +1,9 @@
+from functools import lru_cache
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+@lru_cache(maxsize=None)
 def main_menu():
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="📂 اکانت‌ها", callback_data="list_accounts"))
@@ -17,6 +20,7 @@ def main_menu():
     return builder.as_markup()
 
 # --- User Keyboards ---
+@lru_cache(maxsize=None)
 def user_main_menu():
     builder = InlineKeyboardBuilder()
     builder.row(InlineKeyboardButton(text="👤 اکانت من", callback_data="my_account"))
@@ -35,6 +39,7 @@ def packages_kb(packages, is_admin=False):
     builder.row(InlineKeyboardButton(text="⬅️ بازگشت", callback_data="main_menu" if is_admin else "user_main"))
     return builder.as_markup()
 
+@lru_cache(maxsize=256)
 def payment_review_kb(payment_id):
     builder = InlineKeyboardBuilder()
     builder.row(
@@ -53,6 +58,7 @@ def accounts_list_kb(accounts):
     builder.row(InlineKeyboardButton(text="⬅️ بازگشت", callback_data="main_menu"))
     return builder.as_markup()
 
+@lru_cache(maxsize=256)
 def account_detail_kb(acc_id):
     builder = InlineKeyboardBuilder()
     builder.row(
@@ -0,0 +1,104 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from datetime import datetime, timezone
+
+from config import LOG_LEVEL, LOG_LEVELS, LOG_FILE, LOG_ROTATE, LOG_MAX_BYTES, LOG_BACKUPS, LOG_JSON, LOG_DEBUG_SAMPLE
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DebugSampler(logging.Filter):
+    """Lets through only every n-th DEBUG record per call site; other levels always pass."""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self._seen = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every <= 1:
+            return True
+        key = (record.name, record.lineno)
+        n = self._seen.get(key, 0)
+        self._seen[key] = n + 1
+        return n % self.every == 0
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # The queue is in-process, so the record is passed as is (exc_info included) and
+        # formatted on the listener thread; only the message args are resolved now.
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def _file_handler():
+    os.makedirs(os.path.dirname(LOG_FILE) or ".", exist_ok=True)
+    if LOG_ROTATE == "time":
+        return logging.handlers.TimedRotatingFileHandler(LOG_FILE, when="midnight", backupCount=LOG_BACKUPS, encoding="utf-8")
+    return logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+
+
+def setup_logging():
+    """
+    Routes all logging through a queue: the event loop only enqueues records, a
+    background listener thread formats them and writes the rotating file and console.
+    Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = JsonFormatter() if LOG_JSON else logging.Formatter(TEXT_FORMAT)
+    outputs = [_file_handler(), logging.StreamHandler()]
+    for handler in outputs:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    if LOG_DEBUG_SAMPLE > 1:
+        queue_handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *outputs, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flushes queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
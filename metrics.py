@@ -0,0 +1,235 @@
+import bisect
+import contextvars
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import SLOW_UPDATE_MS, METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (seconds), Prometheus style."""
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class HandlerStats:
+    __slots__ = ("latency", "queries", "query_time", "api_calls", "api_time", "errors")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.queries = 0
+        self.query_time = 0.0
+        self.api_calls = 0
+        self.api_time = 0.0
+        self.errors = 0
+
+
+class UpdateTrace:
+    """What one update cost; lives in a context variable while the update is handled."""
+
+    __slots__ = ("handler", "queries", "query_time", "api_calls", "api_time")
+
+    def __init__(self):
+        self.handler = None
+        self.queries = 0
+        self.query_time = 0.0
+        self.api_calls = 0
+        self.api_time = 0.0
+
+
+_trace = contextvars.ContextVar("update_trace", default=None)
+handlers = {}
+started_at = time.time()
+
+
+def _stats(key):
+    entry = handlers.get(key)
+    if entry is None:
+        entry = handlers[key] = HandlerStats()
+    return entry
+
+
+# --- SQLAlchemy: attribute queries to the update being handled ---
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_query(conn, cursor, statement, parameters, context, executemany):
+    if _trace.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_query(conn, cursor, statement, parameters, context, executemany):
+    trace = _trace.get()
+    if trace is not None and conn.info.get("query_started"):
+        trace.queries += 1
+        trace.query_time += time.perf_counter() - conn.info["query_started"].pop()
+
+
+# --- Telegram API calls made while handling an update ---
+class ApiTimer(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        trace = _trace.get()
+        if trace is None:
+            return await make_request(bot, method)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            trace.api_calls += 1
+            trace.api_time += time.perf_counter() - started
+
+
+# --- aiogram middlewares ---
+class UpdateTimer(BaseMiddleware):
+    """Outer update middleware: times the whole update and files it under its handler."""
+
+    async def __call__(self, handler, event, data):
+        trace = UpdateTrace()
+        token = _trace.set(trace)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            _trace.reset(token)
+            key = trace.handler or f"unhandled:{event.event_type}"
+            entry = _stats(key)
+            entry.latency.observe(elapsed)
+            entry.queries += trace.queries
+            entry.query_time += trace.query_time
+            entry.api_calls += trace.api_calls
+            entry.api_time += trace.api_time
+            entry.errors += failed
+            if elapsed * 1000 >= SLOW_UPDATE_MS:
+                logger.warning(
+                    f"Slow update {event.update_id} in {key}: {elapsed * 1000:.0f}ms "
+                    f"(sql {trace.queries}q/{trace.query_time * 1000:.0f}ms, "
+                    f"api {trace.api_calls}/{trace.api_time * 1000:.0f}ms)"
+                )
+
+
+class HandlerName(BaseMiddleware):
+    """Inner middleware: records which handler the router picked."""
+
+    async def __call__(self, handler, event, data):
+        trace = _trace.get()
+        if trace is not None and "handler" in data:
+            trace.handler = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+def install(dp, bot):
+    dp.update.outer_middleware(UpdateTimer())
+    namer = HandlerName()
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(namer)
+    bot.session.middleware(ApiTimer())
+
+
+# --- Reporting ---
+def snapshot():
+    """Per-handler summary, slowest (p95) first."""
+    rows = []
+    for key, entry in handlers.items():
+        n = entry.latency.count
+        rows.append({
+            "handler": key,
+            "count": n,
+            "avg": entry.latency.total / n if n else 0.0,
+            "p50": entry.latency.quantile(0.5),
+            "p95": entry.latency.quantile(0.95),
+            "max": entry.latency.max,
+            "queries": entry.queries / n if n else 0.0,
+            "sql_time": entry.query_time / n if n else 0.0,
+            "api_time": entry.api_time / n if n else 0.0,
+            "errors": entry.errors,
+        })
+    rows.sort(key=lambda r: r["p95"], reverse=True)
+    return rows
+
+
+def prometheus_text():
+    lines = [
+        "# HELP bot_update_seconds Update handling latency by handler.",
+        "# TYPE bot_update_seconds histogram",
+    ]
+    for key, entry in handlers.items():
+        label = f'handler="{key}"'
+        cumulative = 0
+        for bound, n in zip(BUCKETS, entry.latency.counts):
+            cumulative += n
+            lines.append(f'bot_update_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+        lines.append(f'bot_update_seconds_bucket{{{label},le="+Inf"}} {entry.latency.count}')
+        lines.append(f"bot_update_seconds_sum{{{label}}} {entry.latency.total}")
+        lines.append(f"bot_update_seconds_count{{{label}}} {entry.latency.count}")
+    for name, attr, kind in (
+        ("bot_update_queries_total", "queries", "counter"),
+        ("bot_update_query_seconds_total", "query_time", "counter"),
+        ("bot_update_api_calls_total", "api_calls", "counter"),
+        ("bot_update_api_seconds_total", "api_time", "counter"),
+        ("bot_update_errors_total", "errors", "counter"),
+    ):
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f'{name}{{handler="{key}"}} {getattr(entry, attr)}' for key, entry in handlers.items())
+    return "\n".join(lines) + "\n"
+
+
+async def serve(host=METRICS_HOST, port=METRICS_PORT, extra=None):
+    """
+    Starts the /metrics endpoint and returns its runner (None when METRICS_PORT is 0).
+    `extra` is an optional callable returning more exposition lines (cache, outbox...).
+    """
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def handle(request):
+        body = prometheus_text()
+        if extra:
+            body += "".join(line + "\n" for line in extra())
+        return web.Response(text=body, content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,193 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import select, insert, update
+
+from config import IMPORT_BATCH_SIZE
+from db import async_session, Account
+from parser import EMAIL_RE
+
+logger = logging.getLogger(__name__)
+
+CSV, JSON = "csv", "json"
+UPLOAD_KINDS = {".csv": CSV, ".json": JSON, ".jsonl": JSON}
+
+FIELDS = ("owner_email", "account_label", "login_email", "login_password", "billing_email",
+          "service_name", "activated_at", "cycle_start", "cycle_end", "seats_total", "status", "notes")
+DATE_FIELDS = ("activated_at", "cycle_start", "cycle_end")
+STATUSES = ("active", "expired")
+# Column names accepted besides the model's own
+ALIASES = {"email": "owner_email", "owner": "owner_email", "label": "account_label",
+           "password": "login_password", "seats": "seats_total", "expires": "cycle_end", "service": "service_name"}
+# Values for columns a new account's row leaves empty (every INSERT row carries all columns)
+DEFAULTS = {"service_name": "ChatGPT Business", "seats_total": 0, "status": "active"}
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_kind(filename):
+    """Maps an uploaded file name to an input kind, or None if unsupported."""
+    return UPLOAD_KINDS.get(os.path.splitext(filename or "")[1].lower())
+
+
+def iter_records(raw, kind):
+    """
+    Yields (row number, dict) for every record of an upload. CSV is read row by row;
+    JSON may be an array of objects, {"accounts": [...]} or JSON Lines.
+    """
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8-sig", errors="replace")
+    if kind == CSV:
+        # Row numbers are file lines: the header is line 1
+        for number, row in enumerate(csv.DictReader(raw.splitlines()), 2):
+            yield number, row
+        return
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        if not raw.lstrip().startswith("{"):
+            raise
+        data = None  # several top-level objects: JSON Lines
+    if data is not None:
+        if isinstance(data, dict):
+            data = data.get("accounts", [data])
+        if not isinstance(data, list):
+            raise ValueError("expected an array of accounts")
+        for number, row in enumerate(data, 1):
+            yield number, row
+        return
+    for number, line in enumerate(raw.splitlines(), 1):
+        if line.strip():
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, RowError(f"JSON نامعتبر: {e}")
+
+
+def _date(value):
+    value = value.strip()
+    for fmt in ("%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise RowError(f"تاریخ نامعتبر: {value} (YYYY-MM-DD)")
+
+
+def clean_row(record):
+    """Validates one record; returns the columns it sets (empty cells are left out)."""
+    if isinstance(record, RowError):
+        raise record
+    if not isinstance(record, dict):
+        raise RowError("ردیف باید یک شیء باشد")
+    values = {}
+    for key, value in record.items():
+        key = ALIASES.get((key or "").strip().lower(), (key or "").strip().lower())
+        if key not in FIELDS or value is None:
+            continue
+        if not isinstance(value, str):
+            value = str(value)
+        value = value.strip()
+        if value:
+            values[key] = value
+
+    email = values.get("owner_email")
+    if not email:
+        raise RowError("owner_email خالی است")
+    if not EMAIL_RE.fullmatch(email):
+        raise RowError(f"ایمیل نامعتبر: {email}")
+    for key in DATE_FIELDS:
+        if key in values:
+            values[key] = _date(values[key])
+    if "seats_total" in values:
+        try:
+            values["seats_total"] = int(values["seats_total"])
+        except ValueError:
+            raise RowError(f"تعداد صندلی نامعتبر: {values['seats_total']}")
+        if values["seats_total"] < 0:
+            raise RowError("تعداد صندلی منفی است")
+    if "status" in values:
+        values["status"] = values["status"].lower()
+        if values["status"] not in STATUSES:
+            raise RowError(f"وضعیت نامعتبر: {values['status']}")
+    if values.get("cycle_start") and values.get("cycle_end") and values["cycle_end"] < values["cycle_start"]:
+        raise RowError("cycle_end قبل از cycle_start است")
+    return values
+
+
+async def onboard_accounts(raw, kind):
+    """
+    Creates or updates accounts from an uploaded CSV/JSON document, matched by owner_email.
+
+    Records are validated in one streaming pass against an (owner_email -> id) map
+    loaded up front; valid ones are written in IMPORT_BATCH_SIZE executemany batches
+    (INSERT for new owners, UPDATE by primary key for known ones, touching only the
+    columns the row fills in), all in one transaction. Invalid rows are skipped and
+    reported as (row number, owner_email, reason).
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    report = {"created": 0, "updated": 0, "unchanged": 0, "errors": [], "rows": 0}
+    seen = set()
+    to_insert, to_update = [], []
+
+    async def flush(session, final=False):
+        if to_insert and (final or len(to_insert) >= IMPORT_BATCH_SIZE):
+            await session.execute(insert(Account), to_insert)
+            report["created"] += len(to_insert)
+            to_insert.clear()
+        if to_update and (final or len(to_update) >= IMPORT_BATCH_SIZE):
+            await session.execute(update(Account), to_update)
+            report["updated"] += len(to_update)
+            to_update.clear()
+
+    async with async_session() as session:
+        async with session.begin():
+            existing = {
+                (row.owner_email or "").lower(): row
+                for row in await session.execute(select(Account.id, Account.owner_email, Account.members_count))
+            }
+            try:
+                for number, record in iter_records(raw, kind):
+                    report["rows"] += 1
+                    email = (record.get("owner_email") or record.get("email")) if isinstance(record, dict) else None
+                    try:
+                        values = clean_row(record)
+                        email = values["owner_email"]
+                        key = email.lower()
+                        if key in seen:
+                            raise RowError("owner_email در فایل تکراری است")
+                        current = existing.get(key)
+                        if current is not None and values.get("seats_total", current.members_count) < current.members_count:
+                            raise RowError(f"تعداد صندلی کمتر از {current.members_count} عضو فعلی است")
+                    except RowError as e:
+                        report["errors"].append((number, email or "", str(e)))
+                        continue
+                    seen.add(key)
+                    if current is None:
+                        to_insert.append({**dict.fromkeys(FIELDS), **DEFAULTS, "activated_at": datetime.utcnow(), **values})
+                    else:
+                        values.pop("owner_email")  # keep the stored spelling
+                        if "status" in values:
+                            values["auto_expired_at"] = None  # an explicit status is the admin's call, not the sweep's
+                        if values:
+                            to_update.append({"id": current.id, **values})
+                        else:
+                            report["unchanged"] += 1
+                    await flush(session)
+            except (ValueError, csv.Error) as e:
+                # Broken CSV/JSON document: nothing from this upload is written
+                raise ValueError(f"فایل قابل خواندن نیست: {e}") from e
+            await flush(session, final=True)
+
+    logger.info(
+        f"Onboarded accounts: +{report['created']} ~{report['updated']} "
+        f"({len(report['errors'])} rejected of {report['rows']}) in {loop.time() - started:.2f}s"
+    )
+    return report
@@ -0,0 +1,198 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+
+from config import OUTBOX_WORKERS, OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Lower value = sent first
+ALERT, NORMAL, REPORT = 0, 5, 9
+
+
+class TokenBucket:
+    """Classic token bucket; `reserve()` returns how long the caller must wait for its token."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _Job:
+    __slots__ = ("method", "chat_id", "kwargs", "future", "not_before", "attempts", "enqueued_at")
+
+    def __init__(self, method, chat_id, kwargs, future):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.future = future
+        self.not_before = None  # per-chat slot, reserved on first pick-up
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+
+class Outbox:
+    """
+    Central queue for outgoing Telegram messages.
+
+    Jobs are served by priority (alerts before reports) by a few worker tasks that
+    respect a global and a per-chat token bucket. A job whose chat is still throttled
+    is parked until its slot instead of blocking the workers, so a burst to many chats
+    goes out as fast as Telegram allows. RetryAfter pauses every worker for the
+    requested time; network/5xx errors are retried with backoff.
+    """
+
+    def __init__(self, bot, workers=OUTBOX_WORKERS, global_rate=OUTBOX_GLOBAL_RATE,
+                 chat_rate=OUTBOX_CHAT_RATE, max_retries=OUTBOX_MAX_RETRIES):
+        self.bot = bot
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate)
+        self._chats = {}  # chat_id -> TokenBucket
+        self._queue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._tasks = []
+        self._parked = 0
+        self._pending = 0  # submitted, not yet sent or failed
+        self.metrics = {"sent": 0, "failed": 0, "retried": 0, "retry_after": 0, "latency_total": 0.0}
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        """Lets queued messages drain for up to `timeout` seconds, then stops the workers."""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._pending:
+            logger.warning(f"Outbox stopped with {self._pending} messages unsent")
+        for task in self._tasks:
+            task.cancel()
+
+    def submit(self, method, chat_id, priority=NORMAL, **kwargs):
+        """Queues a Bot API call (e.g. "send_message") and returns a future with its result."""
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(self._done)
+        self._pending += 1
+        self._queue.put_nowait((priority, next(self._seq), _Job(method, chat_id, kwargs, future)))
+        return future
+
+    async def send_message(self, chat_id, text, priority=NORMAL, **kwargs):
+        return await self.submit("send_message", chat_id, priority, text=text, **kwargs)
+
+    async def send_photo(self, chat_id, photo, priority=NORMAL, **kwargs):
+        return await self.submit("send_photo", chat_id, priority, photo=photo, **kwargs)
+
+    async def broadcast(self, chat_ids, text, priority=NORMAL, raise_errors=False, **kwargs):
+        """
+        Sends one text to many chats; failures are logged and the number of chats
+        reached is returned. With `raise_errors`, the last error is raised when no
+        chat at all received the message.
+        """
+        futures = [self.submit("send_message", chat_id, priority, text=text, **kwargs) for chat_id in chat_ids]
+        delivered, error = 0, None
+        for chat_id, result in zip(chat_ids, await asyncio.gather(*futures, return_exceptions=True)):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to send to {chat_id}: {result}")
+                error = result
+            else:
+                delivered += 1
+        if raise_errors and error is not None and not delivered:
+            raise error
+        return delivered
+
+    def _done(self, future):
+        self._pending -= 1
+
+    def _park(self, item, delay):
+        # Re-queue once the delay is over; the job keeps its priority and sequence number
+        self._parked += 1
+        asyncio.get_running_loop().call_later(delay, self._unpark, item)
+
+    def _unpark(self, item):
+        self._parked -= 1
+        self._queue.put_nowait(item)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats.clear()
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, capacity=1)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._process(item)
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, item):
+        job = item[2]
+        if job.future.done():
+            return
+        now = time.monotonic()
+        if job.not_before is None:
+            job.not_before = now + self._chat_bucket(job.chat_id).reserve()
+        if job.not_before > now:
+            self._park(item, job.not_before - now)
+            return
+
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        wait = self._global.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        job.attempts += 1
+        try:
+            result = await getattr(self.bot, job.method)(chat_id=job.chat_id, **job.kwargs)
+        except TelegramRetryAfter as e:
+            self.metrics["retry_after"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            logger.warning(f"Flood control: pausing outbox for {e.retry_after}s")
+            self._park(item, e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if job.attempts > self.max_retries:
+                self._fail(job, e)
+            else:
+                self.metrics["retried"] += 1
+                self._park(item, 2 ** job.attempts)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self.metrics["sent"] += 1
+            self.metrics["latency_total"] += time.monotonic() - job.enqueued_at
+            job.future.set_result(result)
+
+    def _fail(self, job, error):
+        self.metrics["failed"] += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def stats(self):
+        sent = self.metrics["sent"]
+        return {
+            **{k: v for k, v in self.metrics.items() if k != "latency_total"},
+            "queued": self._pending,
+            "avg_latency": self.metrics["latency_total"] / sent if sent else 0.0,
+        }
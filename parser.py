@@ -1,97 +1,158 @@
+import csv
+import itertools
 import re
 from datetime import datetime
 
+# Patterns are compiled once at import time; the engine below never rescans a line.
+EMAIL_RE = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+# Date format like "Dec 20, 2025" (Month Day, Year)
+DATE_RE = re.compile(r'[A-Z][a-z]{2}\s\d{1,2},\s\d{4}')
+# Page chrome that must never be taken for a member name
+HEADER_RE = re.compile(r'Name|Account type|Date added|Invite member|Filter')
+# Headers that start a new section: nothing above them can be a name
+SECTION_RE = re.compile(r'Invite member|Filter')
+ROLES = frozenset(("Member", "Owner", "Admin"))
+
+# How many lines after an email may still carry its role/date
+SEARCH_LIMIT = 9
+
+
+def _parse_date(line):
+    match = DATE_RE.search(line)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(0), "%b %d, %Y")
+    except ValueError:
+        return None
+
+
+def iter_members(lines):
+    """
+    Streams members out of an OpenAI Members page, one dict per email.
+
+    Accepts any iterable of lines (a list, an open file, a generator) and makes
+    a single pass over it. The only state kept between lines is the current
+    member being filled in and a one-line look-behind buffer holding the last
+    line that could be a name, so memory and time stay linear in the input.
+    """
+    name_candidate = None
+    current = None
+    window = 0
+    found_role = found_date = False
+
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            continue
+
+        if current is not None:
+            # Still collecting Role/Date for the previous email
+            window += 1
+            if "@" in line:
+                # Another email (or at least an address-like line) ends the block
+                yield current
+                current = None
+            else:
+                consumed = False
+                if not found_role and line in ROLES:
+                    current["role"] = line
+                    found_role = consumed = True
+                if not found_date:
+                    date_added = _parse_date(line)
+                    if date_added is not None:
+                        current["date_added"] = date_added
+                        found_date = consumed = True
+                if found_role and found_date or window >= SEARCH_LIMIT:
+                    yield current
+                    current = None
+                if consumed:
+                    continue
+
+        email_match = EMAIL_RE.search(line) if "@" in line else None
+        if email_match:
+            current = {
+                "name": name_candidate or "Unknown",
+                "email": email_match.group(0),
+                "role": "Member",
+                "date_added": datetime.utcnow(),
+            }
+            name_candidate = None
+            window = 0
+            found_role = found_date = False
+            continue
+
+        # Look-behind buffer: remember the last line that could be a name
+        if SECTION_RE.search(line):
+            name_candidate = None
+        elif not HEADER_RE.search(line):
+            name_candidate = line
+
+    if current is not None:
+        yield current
+
+
+def csv_header_columns(row):
+    """Maps name/email/role/date to column indexes if `row` is a header row, else {}."""
+    cols = {}
+    for idx, title in enumerate(h.strip().lower() for h in row):
+        if "@" in title:
+            return {}  # an address: this is a data row
+        if "email" in title:
+            cols.setdefault("email", idx)
+        elif "name" in title:
+            cols.setdefault("name", idx)
+        elif "role" in title or "account type" in title:
+            cols.setdefault("role", idx)
+        elif "date" in title:
+            cols.setdefault("date", idx)
+    return cols if "email" in cols else {}
+
+
+def iter_csv_members(lines):
+    """
+    Streams members out of a CSV export (Name, Email, Role/Account type, Date added).
+    Without a recognizable header row every row is scanned cell by cell instead.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    cols = csv_header_columns(header)
+    if not cols:
+        reader = itertools.chain([header], reader)
+
+    for row in reader:
+        cells = [c.strip() for c in row]
+        if cols:
+            pick = {key: cells[idx] if idx < len(cells) else "" for key, idx in cols.items()}
+        else:
+            pick = {
+                "email": next((c for c in cells if "@" in c), ""),
+                "name": next((c for c in cells if c and "@" not in c and c not in ROLES and not DATE_RE.search(c)), ""),
+                "role": next((c for c in cells if c in ROLES), ""),
+                "date": next((c for c in cells if DATE_RE.search(c)), ""),
+            }
+        email_match = EMAIL_RE.search(pick["email"])
+        if not email_match:
+            continue
+        role = pick.get("role", "")
+        yield {
+            "name": pick.get("name") or "Unknown",
+            "email": email_match.group(0),
+            "role": role if role in ROLES else "Member",
+            "date_added": _parse_date(pick.get("date", "")) or datetime.utcnow(),
+        }
+
+
 def parse_members_text(text: str):
     """
     Robustly parses messy text from OpenAI Members page.
     Handles blocks like:
     Name
     Email
-    
+
     Role
     Date
     """
-    # Split by lines and remove completely empty whitespace lines but keep a trace of structure
-    lines = [l.strip() for l in text.split('\n')]
-    
-    members = []
-    
-    # Regex for email
-    email_regex = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-    
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        
-        # Look for an email in the current line
-        email_match = re.search(email_regex, line)
-        
-        if email_match:
-            email = email_match.group(0)
-            
-            # The line BEFORE the email is usually the name
-            name = "Unknown"
-            if i > 0:
-                # Look back for the first non-empty line that isn't a header
-                j = i - 1
-                while j >= 0:
-                    potential_name = lines[j]
-                    if potential_name and not any(h in potential_name for h in ["Name", "Account type", "Date added", "Invite member", "Filter"]):
-                        name = potential_name
-                        break
-                    if "Invite member" in potential_name or "Filter" in potential_name:
-                        break
-                    j -= 1
-            
-            # Look forward for Role and Date
-            role = "Member"
-            date_added = datetime.utcnow()
-            
-            # Search next lines for Role and Date
-            found_role = False
-            found_date = False
-            
-            k = i + 1
-            search_limit = 10 # don't look too far
-            while k < len(lines) and k < i + search_limit:
-                next_line = lines[k]
-                if not next_line:
-                    k += 1
-                    continue
-                
-                # Role is usually 'Member' or 'Owner'
-                if not found_role and next_line in ["Member", "Owner", "Admin"]:
-                    role = next_line
-                    found_role = True
-                
-                # Date format like "Dec 20, 2025"
-                # Pattern: Month Day, Year
-                date_pattern = r'[A-Z][a-z]{2}\s\d{1,2},\s\d{4}'
-                if not found_date and re.search(date_pattern, next_line):
-                    try:
-                        date_str = re.search(date_pattern, next_line).group(0)
-                        date_added = datetime.strptime(date_str, "%b %d, %Y")
-                        found_date = True
-                    except:
-                        pass
-                
-                # If we found another email, stop searching for this member
-                if "@" in next_line and k != i:
-                    break
-                
-                if found_role and found_date:
-                    break
-                k += 1
-                
-            members.append({
-                "name": name,
-                "email": email,
-                "role": role,
-                "date_added": date_added
-            })
-            # Advance i to the end of this member's block to avoid re-parsing
-            i = k - 1
-            
-        i += 1
-            
-    return members
+    return list(iter_members(text.split('\n')))
@@ -0,0 +1,105 @@
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select, update
+
+import rollups
+from config import REVIEW_PAGE_SIZE, REVIEW_LOCK_MINUTES
+from db import async_session, Payment
+
+logger = logging.getLogger(__name__)
+
+
+def _claimable(admin_id, now):
+    return or_(Payment.review_until.is_(None), Payment.review_until < now, Payment.review_by == admin_id)
+
+
+async def claim_review_page(admin_id, after_id=None, size=REVIEW_PAGE_SIZE):
+    """
+    Reserves the next page of pending payments (oldest first) for one admin.
+
+    Candidates come from the (status, created_at) index, after the (created_at, id)
+    of `after_id` when paging forward. The lock is taken by a conditional UPDATE that
+    re-checks the lease, so two admins can never hold the same receipt; the page is
+    whatever this admin actually won. Returns (payments, pending_total).
+    """
+    now = datetime.utcnow()
+    async with async_session() as session:
+        base = select(Payment.id).where(Payment.status == "Pending")
+        if after_id is not None:
+            cursor = (await session.execute(select(Payment.created_at).where(Payment.id == after_id))).scalar()
+            if cursor is not None:
+                base = base.where(or_(Payment.created_at > cursor, and_(Payment.created_at == cursor, Payment.id > after_id)))
+
+        won = []
+        for _ in range(3):  # another admin may win some candidates; try to fill the page again
+            ids = (await session.execute(
+                base.where(_claimable(admin_id, now), Payment.id.not_in(won))
+                .order_by(Payment.created_at, Payment.id).limit(size - len(won))
+            )).scalars().all()
+            if not ids:
+                break
+            await session.execute(
+                update(Payment)
+                .where(Payment.id.in_(ids), Payment.status == "Pending", _claimable(admin_id, now))
+                .values(review_by=admin_id, review_until=now + timedelta(minutes=REVIEW_LOCK_MINUTES))
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            won += (await session.execute(
+                select(Payment.id).where(Payment.id.in_(ids), Payment.review_by == admin_id)
+            )).scalars().all()
+            if len(won) >= size:
+                break
+
+        payments = (await session.execute(
+            select(Payment).where(Payment.id.in_(won)).order_by(Payment.created_at, Payment.id)
+        )).scalars().all() if won else []
+        total = (await session.execute(select(func.count(Payment.id)).where(Payment.status == "Pending"))).scalar()
+    return payments, total
+
+
+async def release_reviews(admin_id):
+    """Drops every review lock held by an admin (e.g. when leaving or paging on)."""
+    async with async_session() as session:
+        await session.execute(
+            update(Payment).where(Payment.review_by == admin_id)
+            .values(review_by=None, review_until=None)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+
+
+async def settle(session, pay_id, admin_id, status, account_id=None):
+    """
+    Marks a pending payment Approved/Rejected and drops its review lock, in the
+    caller's transaction. Only succeeds while the payment is still pending and not
+    locked by another admin; returns False otherwise (nothing is written).
+    Approvals are added to the daily rollup in the same transaction.
+    """
+    now = datetime.utcnow()
+    values = {"status": status, "review_by": None, "review_until": None}
+    if account_id is not None:
+        values["account_id"] = account_id
+    result = await session.execute(
+        update(Payment)
+        .where(Payment.id == pay_id, Payment.status == "Pending", _claimable(admin_id, now))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+    if status == "Approved":
+        await rollups.record(session, payments_approved=1)
+    return True
+
+
+async def reject(pay_id, admin_id):
+    """Rejects a pending payment; returns its user's Telegram id, or None if it was already decided."""
+    async with async_session() as session:
+        async with session.begin():
+            user_id = (await session.execute(select(Payment.user_id).where(Payment.id == pay_id))).scalar()
+            if user_id is None or not await settle(session, pay_id, admin_id, "Rejected"):
+                return None
+    logger.info(f"Admin {admin_id} rejected payment {pay_id}")
+    return user_id
@@ -0,0 +1,164 @@
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from config import REMINDER_DAYS
+from db import async_session, Account, ReminderLog
+
+logger = logging.getLogger(__name__)
+
+
+class ReminderEngine:
+    """
+    Fires expiry reminders at their exact moment (cycle_end - N days).
+
+    Upcoming fire times live in a min-heap built from one indexed query on
+    accounts.cycle_end; the loop sleeps until the earliest one, so nothing runs
+    between events. Changed accounts are re-queued (stale heap entries are skipped
+    lazily), and every delivery is claimed in reminder_log first, so a reminder is
+    sent once per (account, threshold, cycle) even across restarts.
+    """
+
+    def __init__(self, send, thresholds=REMINDER_DAYS):
+        self.send = send  # async send(account, days) -> None
+        self.thresholds = sorted(thresholds, reverse=True)
+        self._heap = []  # (fire_at, account_id, threshold, cycle_end)
+        self._cycle_end = {}  # account_id -> cycle_end the heap entries were built for
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def _push_account(self, acc_id, cycle_end, sent, now):
+        self._cycle_end[acc_id] = cycle_end
+        if cycle_end is None or cycle_end <= now:
+            return
+        overdue = None
+        for days in self.thresholds:
+            fire_at = cycle_end - timedelta(days=days)
+            if fire_at <= now:
+                overdue = days  # thresholds are descending: only the latest passed one matters
+            elif (acc_id, days, cycle_end) not in sent:
+                heapq.heappush(self._heap, (fire_at, acc_id, days, cycle_end))
+        if overdue is not None and (acc_id, overdue, cycle_end) not in sent:
+            heapq.heappush(self._heap, (now, acc_id, overdue, cycle_end))
+
+    async def rebuild(self):
+        """Reloads the schedule from the database (startup and periodic safety net)."""
+        now = datetime.utcnow()
+        async with async_session() as session:
+            rows = (await session.execute(
+                select(Account.id, Account.cycle_end)
+                .where(Account.cycle_end > now)
+                .order_by(Account.cycle_end)
+            )).all()
+            sent = set((await session.execute(
+                select(ReminderLog.account_id, ReminderLog.threshold_days, ReminderLog.cycle_end)
+                .where(ReminderLog.cycle_end > now)
+            )).all())
+        self._heap = []
+        self._cycle_end = {}
+        for acc_id, cycle_end in rows:
+            self._push_account(acc_id, cycle_end, sent, now)
+        logger.info(f"Reminder schedule rebuilt: {len(self._heap)} pending for {len(rows)} accounts")
+        self._wakeup.set()
+
+    def reschedule(self, acc_id, cycle_end):
+        """Called when an account's cycle_end is set or changed."""
+        if self._task is None:
+            return  # not started (another cluster worker runs the reminders); start() rebuilds from the DB
+        if self._cycle_end.get(acc_id, object()) == cycle_end:
+            return
+        self._push_account(acc_id, cycle_end, set(), datetime.utcnow())
+        self._wakeup.set()
+
+    async def _claim(self, acc_id, days, cycle_end):
+        async with async_session() as session:
+            result = await session.execute(
+                sqlite_insert(ReminderLog)
+                .values(account_id=acc_id, threshold_days=days, cycle_end=cycle_end, sent_at=datetime.utcnow())
+                .on_conflict_do_nothing()
+            )
+            await session.commit()
+            return result.rowcount == 1
+
+    async def _release(self, acc_id, days, cycle_end):
+        async with async_session() as session:
+            await session.execute(delete(ReminderLog).where(
+                ReminderLog.account_id == acc_id, ReminderLog.threshold_days == days, ReminderLog.cycle_end == cycle_end
+            ))
+            await session.commit()
+
+    async def _fire(self, acc_id, days, cycle_end):
+        if not await self._claim(acc_id, days, cycle_end):
+            return  # already delivered (e.g. before a restart)
+        try:
+            async with async_session() as session:
+                acc = await session.get(Account, acc_id)
+            if acc is None or acc.cycle_end != cycle_end:
+                return
+            await self.send(acc, days)
+        except Exception as e:
+            # Un-claim so the reminder is retried on the next rebuild
+            logger.error(f"Reminder for account {acc_id} ({days}d) failed: {e}")
+            await self._release(acc_id, days, cycle_end)
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            now = datetime.utcnow()
+            while self._heap and self._heap[0][0] <= now:
+                _, acc_id, days, cycle_end = heapq.heappop(self._heap)
+                if self._cycle_end.get(acc_id) != cycle_end:
+                    continue  # stale entry: the account changed or was removed
+                await self._fire(acc_id, days, cycle_end)
+            timeout = (self._heap[0][0] - datetime.utcnow()).total_seconds() if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        await self.rebuild()
+        self._task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+_engine = None
+
+
+def install(engine):
+    """Makes ORM commits that insert/change/delete accounts re-queue them on `engine`."""
+    global _engine
+    _engine = engine
+
+
+@event.listens_for(Session, "after_flush")
+def _track_accounts(session, flush_context):
+    changed = session.info.setdefault("reminder_accounts", {})
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, Account):
+            changed[obj.id] = obj.cycle_end
+    for obj in session.deleted:
+        if isinstance(obj, Account):
+            changed[obj.id] = None
+
+
+@event.listens_for(Session, "after_commit")
+def _reschedule_on_commit(session):
+    changed = session.info.pop("reminder_accounts", None)
+    if changed and _engine is not None:
+        for acc_id, cycle_end in changed.items():
+            _engine.reschedule(acc_id, cycle_end)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session):
+    session.info.pop("reminder_accounts", None)
@@ -0,0 +1,66 @@
+import logging
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramBadRequest
+
+import cache
+from config import RENDER_SHOWN_SIZE
+
+logger = logging.getLogger(__name__)
+
+# (chat_id, message_id) -> fingerprint of the last render we put there
+_shown = OrderedDict()
+counters = {"edits": 0, "skipped": 0}
+
+
+def _fingerprint(text, reply_markup, parse_mode):
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None
+    return hash((text, markup, parse_mode))
+
+
+def _remember(key, fingerprint):
+    _shown[key] = fingerprint
+    _shown.move_to_end(key)
+    while len(_shown) > RENDER_SHOWN_SIZE:
+        _shown.popitem(last=False)
+
+
+async def edit(message, text, reply_markup=None, parse_mode=None, **kwargs):
+    """
+    edit_text that skips the API call when the message already shows this exact render.
+    Telegram's "message is not modified" error is swallowed the same way. Returns True
+    when an edit was actually sent.
+    """
+    key = (message.chat.id, message.message_id)
+    fingerprint = _fingerprint(text, reply_markup, parse_mode)
+    if _shown.get(key) == fingerprint:
+        counters["skipped"] += 1
+        return False
+    try:
+        await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode, **kwargs)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+        counters["skipped"] += 1
+        _remember(key, fingerprint)
+        return False
+    counters["edits"] += 1
+    _remember(key, fingerprint)
+    return True
+
+
+def forget(message):
+    """Call after changing a message outside `edit` (caption edits, markup-only edits...)."""
+    _shown.pop((message.chat.id, message.message_id), None)
+
+
+async def screen(key, deps, build):
+    """
+    Rendered (text, reply_markup) for a data-driven screen, rebuilt only when one of
+    the `deps` tables changed (same version stamps and LRU as cache.store).
+    """
+    return await cache.store.get_or_load(("screen", *key), deps, build)
+
+
+def stats():
+    return {**counters, "tracked": len(_shown)}
@@ -0,0 +1,144 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from db import async_session, Account, Payment, Invoice, DailyStats, MonthlyStats
+
+logger = logging.getLogger(__name__)
+
+FLOWS = ("payments_created", "payments_approved", "invoices_count", "revenue_billed", "revenue_paid")
+GAUGES = ("accounts_active", "seats_total", "seats_used", "payments_pending")
+
+# Daily and monthly summary rows are kept current two ways:
+#  * flows (new payments, approvals, invoice revenue) are added per event, in the
+#    same transaction as the write that caused them (ORM flush hook / record());
+#  * gauges (active accounts, seats, pending payments) are a cheap snapshot of
+#    aggregate queries taken by snapshot() on a schedule.
+# Reports then read O(days) summary rows instead of scanning history.
+
+
+def _upserts(day, values, add=True):
+    """INSERT ... ON CONFLICT statements for the day row and its month row."""
+    now = datetime.utcnow()
+    for model, key, key_value in ((DailyStats, "day", day), (MonthlyStats, "month", day.strftime("%Y-%m"))):
+        table = model.__table__
+        stmt = sqlite_insert(table).values({key: key_value, **values, "updated_at": now})
+        set_ = {col: (table.c[col] + stmt.excluded[col]) if add else stmt.excluded[col] for col in values}
+        set_["updated_at"] = stmt.excluded.updated_at
+        yield stmt.on_conflict_do_update(index_elements=[key], set_=set_)
+
+
+def _add_flows(connection, deltas):
+    for day, values in deltas.items():
+        values = {k: v for k, v in values.items() if v}
+        if values:
+            for stmt in _upserts(day, values):
+                connection.execute(stmt)
+
+
+async def record(session, day=None, **deltas):
+    """Adds flow deltas (e.g. payments_approved=3) for writes that bypass the ORM flush."""
+    day = day or datetime.utcnow().date()
+    for stmt in _upserts(day, {k: v for k, v in deltas.items() if v}):
+        await session.execute(stmt)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_events(session, flush_context):
+    deltas = defaultdict(lambda: dict.fromkeys(FLOWS, 0))
+    today = datetime.utcnow().date()
+    for obj in session.new:
+        if isinstance(obj, Payment):
+            deltas[(obj.created_at or datetime.utcnow()).date()]["payments_created"] += 1
+            if obj.status == "Approved":
+                deltas[today]["payments_approved"] += 1
+        elif isinstance(obj, Invoice):
+            row = deltas[(obj.invoice_date or datetime.utcnow()).date()]
+            row["invoices_count"] += 1
+            row["revenue_billed"] += obj.total_due or 0
+            row["revenue_paid"] += obj.paid_amount or 0
+    for obj in session.dirty:
+        if isinstance(obj, Payment):
+            history = inspect(obj).attrs.status.history
+            if "Approved" in history.added and "Approved" not in history.deleted:
+                deltas[today]["payments_approved"] += 1
+        elif isinstance(obj, Invoice):
+            state = inspect(obj).attrs
+            billed, paid = state.total_due.history, state.paid_amount.history
+            if billed.has_changes() or paid.has_changes():
+                row = deltas[(obj.invoice_date or datetime.utcnow()).date()]
+                row["revenue_billed"] += (obj.total_due or 0) - sum(v or 0 for v in billed.deleted)
+                row["revenue_paid"] += (obj.paid_amount or 0) - sum(v or 0 for v in paid.deleted)
+    if deltas:
+        _add_flows(session.connection(), deltas)
+
+
+async def snapshot():
+    """Refreshes today's (and this month's) gauges from a few indexed aggregates."""
+    now = datetime.utcnow()
+    async with async_session() as session:
+        accounts_active = (await session.execute(
+            select(func.count(Account.id)).where(Account.status == "active", Account.cycle_end > now)
+        )).scalar()
+        seats_total, seats_used = (await session.execute(
+            select(func.coalesce(func.sum(Account.seats_total), 0), func.coalesce(func.sum(Account.members_count), 0))
+            .where(Account.status == "active")
+        )).one()
+        pending = (await session.execute(
+            select(func.count(Payment.id)).where(Payment.status == "Pending")
+        )).scalar()
+        gauges = {"accounts_active": accounts_active, "seats_total": seats_total,
+                  "seats_used": seats_used, "payments_pending": pending}
+        for stmt in _upserts(now.date(), gauges, add=False):
+            await session.execute(stmt)
+        await session.commit()
+    return gauges
+
+
+async def backfill():
+    """One-off: rebuilds flow columns from history when the summary tables are empty."""
+    async with async_session() as session:
+        if (await session.execute(select(func.count()).select_from(DailyStats))).scalar():
+            return False
+        deltas = defaultdict(lambda: dict.fromkeys(FLOWS, 0))
+        payment_days = func.date(Payment.created_at)
+        for day, created, approved in await session.execute(
+            select(payment_days, func.count(Payment.id), func.sum(case((Payment.status == "Approved", 1), else_=0)))
+            .where(Payment.created_at.is_not(None)).group_by(payment_days)
+        ):
+            deltas[day]["payments_created"] += created
+            deltas[day]["payments_approved"] += approved or 0
+        invoice_days = func.date(Invoice.invoice_date)
+        for day, count, billed, paid in await session.execute(
+            select(invoice_days, func.count(Invoice.id), func.sum(Invoice.total_due), func.sum(Invoice.paid_amount))
+            .where(Invoice.invoice_date.is_not(None)).group_by(invoice_days)
+        ):
+            row = deltas[day]
+            row["invoices_count"] += count
+            row["revenue_billed"] += billed or 0
+            row["revenue_paid"] += paid or 0
+        for day, values in deltas.items():
+            for stmt in _upserts(datetime.strptime(day, "%Y-%m-%d").date(), {k: v for k, v in values.items() if v}):
+                await session.execute(stmt)
+        await session.commit()
+    logger.info(f"Stats backfilled for {len(deltas)} days")
+    return True
+
+
+async def recent_days(days=7):
+    async with async_session() as session:
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+        return (await session.execute(
+            select(DailyStats).where(DailyStats.day >= since).order_by(DailyStats.day.desc())
+        )).scalars().all()
+
+
+async def recent_months(months=6):
+    async with async_session() as session:
+        return (await session.execute(
+            select(MonthlyStats).order_by(MonthlyStats.month.desc()).limit(months)
+        )).scalars().all()
@@ -0,0 +1,100 @@
+import logging
+import re
+
+from sqlalchemy import select, text
+
+import cache
+from config import SEARCH_RESULTS
+from db import async_session, Account, Member, SEARCH_TABLE
+
+logger = logging.getLogger(__name__)
+
+MEMBER, ACCOUNT = "member", "account"
+MIN_QUERY = 2  # trigram needs 3 characters; 2-character queries fall back to a LIKE scan
+
+_SPACE_RE = re.compile(r"\s+")
+
+# Ranking with bm25 costs time per match, so only queries matching at most RANK_CAP
+# documents are ranked; broader ones return their first matches unranked.
+RANK_CAP = 500
+_PREFIX = "(name LIKE :prefix ESCAPE '\\' OR email LIKE :prefix ESCAPE '\\' OR telegram_id LIKE :prefix ESCAPE '\\')"
+_PROBE_SQL = text(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match LIMIT :cap")
+# Prefix hits (the field starts with the query) come first, then FTS5's bm25 rank
+_RANKED_SQL = text(f"""
+    SELECT rowid, name, email, telegram_id, {_PREFIX} AS is_prefix
+    FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match
+    ORDER BY is_prefix DESC, bm25({SEARCH_TABLE}) LIMIT :limit
+""")
+_FIRST_SQL = text(f"""
+    SELECT rowid, name, email, telegram_id, {_PREFIX} AS is_prefix
+    FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match LIMIT :limit
+""")
+# Queries too short for trigrams scan the table; without ORDER BY the scan stops at :limit hits
+_LIKE_SQL = text(f"""
+    SELECT rowid, name, email, telegram_id, {_PREFIX} AS is_prefix
+    FROM {SEARCH_TABLE}
+    WHERE name LIKE :substr ESCAPE '\\' OR email LIKE :substr ESCAPE '\\' OR telegram_id LIKE :substr ESCAPE '\\'
+    LIMIT :limit
+""")
+
+
+def normalize(query):
+    return _SPACE_RE.sub(" ", (query or "").strip().lower())
+
+
+def _like_escape(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _match_expr(query):
+    # Every word of 3+ characters must appear somewhere (substring, any column)
+    words = [w for w in query.split(" ") if len(w) >= 3]
+    return " AND ".join('"' + w.replace('"', '""') + '"' for w in words)
+
+
+async def _run(query, limit):
+    match = _match_expr(query)
+    params = {"prefix": _like_escape(query) + "%", "limit": limit}
+    async with async_session() as session:
+        if not match:
+            rows = (await session.execute(_LIKE_SQL, {**params, "substr": "%" + _like_escape(query) + "%"})).all()
+        elif len((await session.execute(_PROBE_SQL, {"match": match, "cap": RANK_CAP + 1})).all()) <= RANK_CAP:
+            rows = (await session.execute(_RANKED_SQL, {**params, "match": match})).all()
+        else:
+            rows = (await session.execute(_FIRST_SQL, {**params, "match": match})).all()
+        rows = sorted(rows, key=lambda row: not row.is_prefix)  # stable: keeps rank order within groups
+
+        member_ids = [row.rowid // 2 for row in rows if row.rowid % 2 == 0]
+        accounts_of = {}
+        if member_ids:
+            accounts_of = {
+                r.id: (r.account_id, r.account_label)
+                for r in await session.execute(
+                    select(Member.id, Member.account_id, Account.account_label)
+                    .outerjoin(Account, Member.account_id == Account.id)
+                    .where(Member.id.in_(member_ids))
+                )
+            }
+
+    results = []
+    for row in rows:
+        if row.rowid % 2:
+            results.append({"kind": ACCOUNT, "id": row.rowid // 2, "name": row.name, "email": row.email,
+                            "telegram_id": None, "account_id": row.rowid // 2, "account_label": row.name})
+        else:
+            account_id, label = accounts_of.get(row.rowid // 2, (None, None))
+            results.append({"kind": MEMBER, "id": row.rowid // 2, "name": row.name, "email": row.email,
+                            "telegram_id": row.telegram_id, "account_id": account_id, "account_label": label})
+    return results
+
+
+async def search(query, limit=SEARCH_RESULTS):
+    """
+    Ranked member/account matches for a free-text query (name, email, Telegram id,
+    account label or owner email). Recent queries are served from cache.store until
+    a member or account changes.
+    """
+    query = normalize(query)
+    if len(query) < MIN_QUERY:
+        return []
+    return await cache.store.get_or_load(("search", query, limit), ("members", "accounts"), lambda: _run(query, limit))
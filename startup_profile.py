@@ -0,0 +1,75 @@
+"""
+Startup profiler behind `python bot.py --profile-startup`.
+
+install() wraps the import machinery before bot.py pulls in its dependencies and
+charges every first-time import to the top-level package it belongs to (nested
+imports count towards the outermost one). report() prints that breakdown together
+with the timed startup phases. Imports that happen after mark_ready() (warm-up,
+first use) are listed as deferred and not counted towards the time to poll.
+"""
+import builtins
+import sys
+import time
+
+_real_import = builtins.__import__
+_depth = 0
+started = time.perf_counter()
+ready = None  # set by mark_ready() once the bot could start polling
+imports = {}  # top-level package -> seconds; deferred imports get a "(deferred)" suffix
+phases = []  # (name, seconds)
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    global _depth
+    if level or name in sys.modules:
+        return _real_import(name, globals, locals, fromlist, level)
+    outermost = _depth == 0
+    _depth += 1
+    t = time.perf_counter()
+    try:
+        return _real_import(name, globals, locals, fromlist, level)
+    finally:
+        _depth -= 1
+        if outermost:
+            root = name.partition(".")[0] + (" (deferred)" if ready else "")
+            imports[root] = imports.get(root, 0.0) + time.perf_counter() - t
+
+
+def install():
+    builtins.__import__ = _timed_import
+
+
+def mark_ready():
+    global ready
+    ready = time.perf_counter()
+
+
+def uninstall():
+    builtins.__import__ = _real_import
+
+
+class phase:
+    """Context manager that records how long a startup step took."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+
+    def __exit__(self, *exc):
+        phases.append((self.name, time.perf_counter() - self.t))
+
+
+def report(top=20):
+    uninstall()
+    total = (ready or time.perf_counter()) - started
+    import_total = sum(v for k, v in imports.items() if not k.endswith("(deferred)"))
+    print(f"Startup profile: {total * 1000:.0f}ms until ready to poll")
+    print(f"\n{'import':<32}{'ms':>9}{'share':>8}")
+    for name, seconds in sorted(imports.items(), key=lambda kv: kv[1], reverse=True)[:top]:
+        print(f"{name:<32}{seconds * 1000:>9.1f}{seconds / total:>8.0%}")
+    print(f"{'(imports before ready)':<32}{import_total * 1000:>9.1f}{import_total / total:>8.0%}")
+    print(f"\n{'phase':<32}{'ms':>9}")
+    for name, seconds in phases:
+        print(f"{name:<32}{seconds * 1000:>9.1f}")
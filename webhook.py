@@ -0,0 +1,165 @@
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+
+from aiohttp import web
+from aiogram.types import Update
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET,
+    WEBHOOK_HANDLING, WEBHOOK_DRAIN_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+CONCURRENT, SEQUENTIAL = "concurrent", "sequential"
+
+
+class UpdateReceiver:
+    """
+    aiohttp handler that accepts Telegram updates and feeds them to the dispatcher.
+
+    Every request is answered with 200 as soon as the update is accepted, so Telegram
+    never waits on (or retries because of) a slow handler. In "concurrent" mode each
+    update runs in its own task; in "sequential" mode updates go through one queue and
+    are handled strictly in arrival order, like polling without handle_as_tasks.
+    """
+
+    def __init__(self, dp, bot, secret=WEBHOOK_SECRET, handling=WEBHOOK_HANDLING):
+        if handling not in (CONCURRENT, SEQUENTIAL):
+            raise ValueError(f"Unknown webhook handling mode: {handling}")
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.handling = handling
+        self.accepting = True
+        self._tasks = set()
+        self._queue = asyncio.Queue()
+        self._worker = None
+        self.received = 0
+        self.rejected = 0
+
+    def start(self):
+        if self.handling == SEQUENTIAL and self._worker is None:
+            self._worker = asyncio.create_task(self._run_queue())
+
+    async def handle(self, request):
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.rejected += 1
+            logger.warning(f"Rejected webhook request from {request.remote}: bad secret token")
+            return web.Response(status=401)
+        if not self.accepting:
+            # Telegram retries non-2xx responses, so nothing is lost while we restart
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logger.warning(f"Malformed webhook payload: {e}")
+            return web.Response(status=400)
+
+        self.received += 1
+        if self.handling == SEQUENTIAL:
+            self._queue.put_nowait(update)
+        else:
+            task = asyncio.create_task(self._feed(update))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _feed(self, update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Update {update.update_id} failed: {e}", exc_info=True)
+
+    async def _run_queue(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await self._feed(update)
+            finally:
+                self._queue.task_done()
+
+    def pending(self):
+        return len(self._tasks) + self._queue.qsize()
+
+    async def drain(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Stops accepting updates and waits up to `timeout` seconds for in-flight ones."""
+        self.accepting = False
+        left = self.pending()
+        if left:
+            logger.info(f"Draining {left} in-flight updates...")
+        try:
+            await asyncio.wait_for(self._wait_idle(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Drain timed out with {self.pending()} updates unfinished")
+        if self._worker:
+            self._worker.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def _wait_idle(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        await self._queue.join()
+
+
+def make_app(receiver, path=WEBHOOK_PATH):
+    app = web.Application()
+    app.router.add_post(path, receiver.handle)
+    return app
+
+
+async def run_webhook(dp, bot, stop_event=None, host=WEBHOOK_HOST, port=WEBHOOK_PORT, **receiver_kw):
+    """
+    Serves updates over HTTP until SIGINT/SIGTERM (or `stop_event`), then drains.
+
+    When WEBHOOK_URL is set the webhook is (re)registered with Telegram on start,
+    using WEBHOOK_SECRET or a fresh random secret token if none is configured.
+    """
+    if "secret" not in receiver_kw:
+        receiver_kw["secret"] = WEBHOOK_SECRET or (secrets.token_urlsafe(32) if WEBHOOK_URL else "")
+    receiver = UpdateReceiver(dp, bot, **receiver_kw)
+    if not receiver.secret:
+        logger.warning("Webhook secret token is not set; requests are not authenticated")
+
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    runner = web.AppRunner(make_app(receiver))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    receiver.start()
+    logger.info(f"Webhook server listening on {host}:{port}{WEBHOOK_PATH} ({receiver.handling})")
+
+    await dp.emit_startup(bot=bot)
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=receiver.secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info(f"Webhook registered at {WEBHOOK_URL}")
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Webhook shutting down")
+        await receiver.drain()
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.remove_signal_handler(sig)
+            except (NotImplementedError, RuntimeError):
+                pass
+        await bot.session.close()
+    return receiver